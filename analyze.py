@@ -1,79 +1,78 @@
 # analyze.py
-import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+import pandas as pd
 import seaborn as sns
-import os
 
 # Cấu hình
 EVAL_PATH = "data/evaluations.csv"
 PLOT_DIR = "static/plots"
-os.makedirs(PLOT_DIR, exist_ok=True)
+STATE_PATH = os.path.join(PLOT_DIR, ".render_state.json")
+# Bản sao ảnh có hash nội dung trong tên file (cache lâu dài ở trình duyệt) + manifest cho app.py
+HASHED_DIR = os.path.join(PLOT_DIR, "v")
+MANIFEST_PATH = os.path.join(PLOT_DIR, "manifest.json")
 
-df = pd.read_csv(EVAL_PATH)
 
 # =========================
-# FIGURE 1: Vote bar chart
+# Các hàm vẽ: mỗi job nhận đúng phần dữ liệu nó cần
 # =========================
-vote_counts = df["voted_model"].value_counts().sort_index()
-sns.barplot(x=vote_counts.index, y=vote_counts.values)
-plt.title("Vote Distribution by Model")
-plt.ylabel("Vote Count")
-plt.xlabel("Model")
-plt.tight_layout()
-plt.savefig(f"{PLOT_DIR}/votes.png")
-plt.clf()
-
-# ============================
+def bar_per_model(series, title, ylabel, path, ylim=None):
+    plt.figure()
+    sns.barplot(x=series.index, y=series.values)
+    plt.title(title)
+    plt.ylabel(ylabel)
+    plt.xlabel("Model")
+    if ylim:
+        plt.ylim(*ylim)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+# FIGURE 1: Vote bar chart
+def render_votes(df):
+    vote_counts = df["voted_model"].value_counts().sort_index()
+    bar_per_model(vote_counts, "Vote Distribution by Model", "Vote Count", f"{PLOT_DIR}/votes.png")
+
+
 # FIGURE 2: MCQ Accuracy chart
-# ============================
-acc_per_model = df.groupby("voted_model")["mcq_correct"].mean().mul(100).sort_index()
-sns.barplot(x=acc_per_model.index, y=acc_per_model.values)
-plt.title("MCQ Accuracy per Model")
-plt.ylabel("Accuracy (%)")
-plt.xlabel("Model")
-plt.ylim(0, 100)
-plt.tight_layout()
-plt.savefig(f"{PLOT_DIR}/accuracy.png")
-plt.clf()
-
-# ==============================
+def render_accuracy(df):
+    acc_per_model = df.groupby("voted_model")["mcq_correct"].mean().mul(100).sort_index()
+    bar_per_model(acc_per_model, "MCQ Accuracy per Model", "Accuracy (%)", f"{PLOT_DIR}/accuracy.png", ylim=(0, 100))
+
+
 # FIGURE 3: Likeable / Believable
-# ==============================
-for col in ["likeable", "believable"]:
-    if col in df.columns:
-        model_group = df.groupby("voted_model")[col].mean().sort_index()
-        sns.barplot(x=model_group.index, y=model_group.values)
-        plt.title(f"{col.capitalize()} Score per Model")
-        plt.ylabel("Average Score")
-        plt.xlabel("Model")
-        plt.tight_layout()
-        plt.savefig(f"{PLOT_DIR}/{col}.png")
-        plt.clf()
-
-# ==============================
+def render_score(df, col):
+    model_group = df.groupby("voted_model")[col].mean().sort_index()
+    bar_per_model(model_group, f"{col.capitalize()} Score per Model", "Average Score", f"{PLOT_DIR}/{col}.png")
+
+
 # FIGURE 4: ROD / ROS charts
-# ==============================
-for col in ["rod", "ros"]:
-    if col in df.columns:
-        model_group = df.groupby("voted_model")[col].mean().sort_index()
-        sns.barplot(x=model_group.index, y=model_group.values)
-        plt.title(f"{col.upper()} Rate per Model")
-        plt.ylabel("Proportion")
-        plt.xlabel("Model")
-        plt.tight_layout()
-        plt.savefig(f"{PLOT_DIR}/{col}.png")
-        plt.clf()
-# ==============================
+def render_rate(df, col):
+    model_group = df.groupby("voted_model")[col].mean().sort_index()
+    bar_per_model(model_group, f"{col.upper()} Rate per Model", "Proportion", f"{PLOT_DIR}/{col}.png")
+
+
 # FIGURE 5: Has Issues vs No Issues per MCQ Type
-# ==============================
-if "mcq_type" in df.columns and "error_type" in df.columns:
+def render_mcq_issues(df):
     df_issue = df.copy()
-    df_issue["has_issue"] = df_issue["error_type"].apply(lambda x: x.strip().lower() != "none" and x.strip() != "")
+    # error_type trống (app ghi "" → pandas đọc thành NaN) = không có lỗi
+    errors = df_issue["error_type"].fillna("").astype(str).str.strip()
+    df_issue["has_issue"] = (errors.str.lower() != "none") & (errors != "")
 
     issue_summary = (
         df_issue.groupby(["mcq_type", "voted_model"])["has_issue"]
         .value_counts(normalize=True)
         .unstack(fill_value=0)
+        .reindex(columns=[False, True], fill_value=0)
         .rename(columns={False: "No Issue", True: "Has Issues"})
         .reset_index()
     )
@@ -84,42 +83,34 @@ if "mcq_type" in df.columns and "error_type" in df.columns:
     for i, col in enumerate(issue_pivot.columns):
         issue_part = issue_pivot[col]
         no_issue_part = 1 - issue_part
-        bar1 = ax.barh(issue_part.index, no_issue_part, left=0.0, label='No Issue' if i == 0 else "")
-        bar2 = ax.barh(issue_part.index, issue_part, left=no_issue_part, label='Has Issues' if i == 0 else "")
+        ax.barh(issue_part.index, no_issue_part, left=0.0, label='No Issue' if i == 0 else "")
+        ax.barh(issue_part.index, issue_part, left=no_issue_part, label='Has Issues' if i == 0 else "")
 
     ax.set_title("Issue Rate per MCQ Type")
     ax.set_xlabel("Proportion")
     ax.legend()
     plt.tight_layout()
     plt.savefig(f"{PLOT_DIR}/mcq_issues_stacked.png")
-    plt.clf()
-# ==============================
-# FIGURE 6: Error Type Distribution per MCQ Type
-# ==============================
-if "mcq_type" in df.columns and "error_type" in df.columns:
-    filtered_df = df[df["error_type"].notna() & (df["error_type"].str.strip() != "none") & (df["error_type"].str.strip() != "")]
-
-    error_counts = (
-        filtered_df.groupby(["mcq_type", "voted_model", "error_type"])
-        .size()
-        .reset_index(name="count")
-    )
+    plt.close(fig)
+
+
+# FIGURE 6: Error Type Distribution cho 1 cặp (mcq_type, model)
+def render_error_dist(df, mcq_type, model, error_types):
+    counts = df["error_type"].value_counts().reindex(error_types, fill_value=0)
+    row = counts / counts.sum()
+    row.name = (mcq_type, model)
+    plt.figure(figsize=(8, 5))
+    row.plot(kind="bar", stacked=True, title=f"Error Distribution - {mcq_type} - {model}")
+    plt.ylabel("Proportion")
+    plt.ylim(0, 1)
+    plt.tight_layout()
+    safe_mcq = mcq_type.replace("/", "_")
+    plt.savefig(f"{PLOT_DIR}/error_dist_{safe_mcq}_{model}.png")
+    plt.close()
+
 
-    error_pivot = error_counts.pivot_table(index=["mcq_type", "voted_model"], columns="error_type", values="count", fill_value=0)
-    error_pivot_pct = error_pivot.div(error_pivot.sum(axis=1), axis=0)
-
-    for (mcq_type, model), row in error_pivot_pct.iterrows():
-        row.plot(kind="bar", stacked=True, title=f"Error Distribution - {mcq_type} - {model}")
-        plt.ylabel("Proportion")
-        plt.ylim(0, 1)
-        plt.tight_layout()
-        safe_mcq = mcq_type.replace("/", "_")
-        plt.savefig(f"{PLOT_DIR}/error_dist_{safe_mcq}_{model}.png")
-        plt.clf()
-# ==============================
 # TABLE 1: Accuracy by MCQ Type, Native, and Story
-# ==============================
-if {"mcq_type", "is_native", "with_story", "mcq_correct"}.issubset(df.columns):
+def render_accuracy_table(df):
     acc_table = (
         df.groupby(["is_native", "with_story", "mcq_type"])["mcq_correct"]
         .mean()
@@ -128,4 +119,158 @@ if {"mcq_type", "is_native", "with_story", "mcq_correct"}.issubset(df.columns):
         .unstack(level=2)
     )
     acc_table.to_csv(f"{PLOT_DIR}/accuracy_by_group.csv")
-    
+
+
+# =========================
+# Danh sách job: (tên, hàm vẽ, phần dữ liệu đầu vào, tham số thêm)
+# =========================
+def build_jobs(df):
+    jobs = []
+
+    def add(name, func, columns, data=None, *extra):
+        if set(columns).issubset(df.columns):
+            jobs.append((name, func, (df if data is None else data)[columns], extra))
+
+    add("votes", render_votes, ["voted_model"])
+    add("accuracy", render_accuracy, ["voted_model", "mcq_correct"])
+    for col in ["likeable", "believable"]:
+        add(col, render_score, ["voted_model", col], None, col)
+    for col in ["rod", "ros"]:
+        add(col, render_rate, ["voted_model", col], None, col)
+    add("mcq_issues_stacked", render_mcq_issues, ["mcq_type", "voted_model", "error_type"])
+
+    if {"mcq_type", "voted_model", "error_type"}.issubset(df.columns):
+        filtered_df = df[df["error_type"].notna() & (df["error_type"].str.strip() != "none") & (df["error_type"].str.strip() != "")]
+        error_types = sorted(filtered_df["error_type"].unique())
+        for (mcq_type, model), group in filtered_df.groupby(["mcq_type", "voted_model"]):
+            safe_mcq = mcq_type.replace("/", "_")
+            add(f"error_dist_{safe_mcq}_{model}", render_error_dist, ["error_type"], group,
+                mcq_type, model, error_types)
+
+    add("accuracy_by_group", render_accuracy_table, ["is_native", "with_story", "mcq_type", "mcq_correct"])
+    return jobs
+
+
+def job_hash(data, extra):
+    """Hash phần dữ liệu của job: không đổi → không cần vẽ lại."""
+    h = hashlib.sha256(data.to_csv(index=False).encode("utf-8"))
+    h.update(json.dumps(extra, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def run_job(func, data, extra):
+    func(data, *extra)
+
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    tmp_path = f"{STATE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest():
+    """Ghi manifest {name → v/<name>.<hash>.png} cho mọi ảnh trong PLOT_DIR.
+
+    Giữ lại file hash của manifest trước để trang đang mở vẫn tải được ảnh cũ.
+    """
+    os.makedirs(HASHED_DIR, exist_ok=True)
+    images = []
+    for name in sorted(os.listdir(PLOT_DIR)):
+        path = os.path.join(PLOT_DIR, name)
+        if not (name.endswith(".png") and os.path.isfile(path)):
+            continue
+        hashed = f"{name[:-len('.png')]}.{file_hash(path)}.png"
+        target = os.path.join(HASHED_DIR, hashed)
+        if not os.path.exists(target):
+            shutil.copyfile(path, target + ".tmp")
+            os.replace(target + ".tmp", target)
+        images.append({"name": name, "file": hashed})
+
+    previous = {image["file"] for image in load_manifest().get("images", [])}
+    manifest = {
+        "version": hashlib.sha256(json.dumps(images).encode("utf-8")).hexdigest()[:16],
+        "images": images,
+    }
+    tmp_path = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+    keep = previous | {image["file"] for image in images}
+    for name in os.listdir(HASHED_DIR):
+        if name not in keep:
+            os.remove(os.path.join(HASHED_DIR, name))
+    return manifest
+
+
+def main(only=None, force=False, workers=None):
+    os.makedirs(PLOT_DIR, exist_ok=True)
+    df = pd.read_csv(EVAL_PATH)
+    jobs = build_jobs(df)
+    if only:
+        unknown = set(only) - {name for name, *_ in jobs}
+        if unknown:
+            raise SystemExit(f"❌ Unknown figure(s) {sorted(unknown)}. Available: {[name for name, *_ in jobs]}")
+        jobs = [job for job in jobs if job[0] in only]
+
+    state = load_state()
+    todo = []
+    for name, func, data, extra in jobs:
+        digest = job_hash(data, extra)
+        if not force and state.get(name) == digest:
+            print(f"[⏭️] {name}: unchanged")
+            continue
+        todo.append((name, func, data, extra, digest))
+
+    failed = 0
+    if not todo:
+        write_manifest()
+        return failed
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {name: (pool.submit(run_job, func, data, extra), digest)
+                   for name, func, data, extra, digest in todo}
+        for name, (future, digest) in futures.items():
+            try:
+                future.result()
+                state[name] = digest
+                print(f"[✓] {name}")
+            except Exception as e:
+                failed += 1
+                print(f"[✗] {name} → {e}")
+    save_state(state)
+    write_manifest()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="*", default=None, help="Chỉ vẽ lại các hình này (vd. votes accuracy)")
+    parser.add_argument("--force", action="store_true", help="Vẽ lại kể cả khi dữ liệu không đổi")
+    parser.add_argument("--workers", type=int, default=None, help="Số process vẽ song song")
+    args = parser.parse_args()
+    raise SystemExit(1 if main(args.only, args.force, args.workers) else 0)
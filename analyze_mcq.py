@@ -7,39 +7,37 @@ import json
 import re
 import matplotlib.pyplot as plt
 import seaborn as sns
-
-# ==== Load data ====
-df = pd.read_csv("outputs/merged_mcq.tsv", sep="\t")
-
-# ==== Parse mcqs_json ====
-def parse_mcq_json(mcq_json):
-    try:
-        mcqs = json.loads(mcq_json)
-        if isinstance(mcqs, dict) and "error" in mcqs:
-            return None
-        if isinstance(mcqs, list):
-            return mcqs
-    except:
-        return None
-
-df["mcqs"] = df["mcqs_json"].apply(parse_mcq_json)
-
-# ==== Stats ====
-n_doctrines = df["doctrine"].nunique()
-n_rows = len(df)
-n_errors = df["mcqs"].isnull().sum()
-
-valid_counts = df.groupby("model")["mcqs"].apply(lambda x: x.notnull().sum())
-
-def mcq_stats(mcqs):
-    if mcqs is None:
-        return (0, 0)
-    num_q = len(mcqs)
-    avg_opts = round(sum(len(q["options"]) for q in mcqs) / num_q, 2) if num_q else 0
-    return (num_q, avg_opts)
-
-df[["num_questions", "avg_options"]] = df["mcqs"].apply(lambda x: pd.Series(mcq_stats(x)))
-mcq_summary = df.groupby("model")[["num_questions", "avg_options"]].mean().round(2)
+from mcq_dataset import load_mcq_table
+
+# ==== Load data: bảng MCQ chuẩn hoá (1 dòng / câu hỏi, dòng lỗi có position = -1) ====
+table = load_mcq_table(columns=["doctrine", "model", "unit", "position", "n_options", "unit_status"])
+
+# ==== Stats theo từng (doctrine, model) ====
+units = table.groupby("unit").agg(
+    doctrine=("doctrine", "first"),
+    model=("model", "first"),
+    unit_status=("unit_status", "first"),
+    num_questions=("position", lambda p: int((p >= 0).sum())),
+    total_options=("n_options", "sum"),
+)
+# JSON hợp lệ dạng list (kể cả rỗng) được tính là hợp lệ như trước
+units["valid"] = units["unit_status"].isin(["ok", "empty"])
+units["avg_options"] = (units["total_options"] / units["num_questions"].where(units["num_questions"] > 0)).round(2).fillna(0)
+
+n_doctrines = units["doctrine"].nunique()
+n_rows = len(units)
+n_errors = (~units["valid"]).sum()
+
+valid_counts = units.groupby("model")["valid"].sum()
+
+# MCQ lỗi được tính là (0 câu hỏi, 0 lựa chọn) như trước
+mcq_summary = units.groupby("model")[["num_questions", "avg_options"]].mean().round(2)
+
+# Phân loại lỗi theo model (mức dòng JSON và mức câu hỏi)
+error_breakdown = (
+    load_mcq_table(columns=["model", "status"])
+    .groupby(["model", "status"]).size().unstack(fill_value=0)
+)
 
 # ==== Save CSV ====
 summary_csv = "outputs/mcq_summary.csv"
@@ -66,6 +64,8 @@ with open(report_md, "w") as f:
     f.write(valid_counts.to_string())
     f.write("\n\n## Avg questions & options per model\n")
     f.write(mcq_summary.to_string())
+    f.write("\n\n## Question status per model\n")
+    f.write(error_breakdown.to_string())
 
 print(f"✅ CSV: {summary_csv}")
 print(f"✅ PNG: {plot_path}")
@@ -1,63 +1,170 @@
-from flask import Flask, render_template, request, redirect, url_for
-import pandas as pd
-import os
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, render_template, request, redirect, url_for, jsonify, make_response, send_from_directory
+import hashlib
 import json
+import os
+import threading
+from eval_store import get_store
+from plot_worker import PlotRegenerator
+from eval_aggregates import EvalAggregates
+from scheduler import CoverageScheduler, order_key
+import metrics
+from metrics import phase
+from mcq_dataset import (load_mcq_dataset, load_mcq_table, load_manifest, MCQ_TYPES,
+                         PARQUET_PATH, TABLE_PATH, MANIFEST_PATH)
 
 app = Flask(__name__)
+# Histogram theo route/bước tại /metrics; SLOW_REQUEST_MS=... để ghi log request chậm
+metrics.init_app(app)
 
 DATA_PATH = "outputs/merged_mcq.tsv"
 EVAL_PATH = "data/evaluations.csv"
+# "lazy": / đọc manifest doctrine, dữ liệu nặng (pandas + MCQ) nạp ở request đầu cần đến
+# "eager": dựng index ngay khi import như trước
+STARTUP_MODE = os.getenv("APP_STARTUP", "lazy")
+
+# Thời gian khởi động (in ra khi import xong, xem lại ở /api/startup)
+startup_report = {"mode": STARTUP_MODE, "import_seconds": None, "data_load_seconds": None,
+                  "data_loaded_at": None, "index_source": None}
+
+
+# ==== Index doctrine → stories + MCQs (dựng 1 lần, tự nạp lại khi file đổi) ====
+MCQ_COLUMNS = ["doctrine", "type", "question", "options", "answer"]
+
+
+def build_doctrine_index(stories_df, mcq_table):
+    """Gom dữ liệu theo doctrine: 3 story đầu tiên (mỗi model 1 story) và
+    câu hỏi hợp lệ đầu tiên của mỗi loại từ bảng MCQ chuẩn hoá, để mỗi
+    request chỉ còn 1 lần tra dict."""
+    index = {}
+    for doctrine, model, story in zip(stories_df["doctrine"], stories_df["model"], stories_df["story"]):
+        entry = index.setdefault(doctrine, {"stories": [], "mcqs": {t: None for t in MCQ_TYPES}})
+        # Lấy 3 story từ 3 model khác nhau
+        stories = entry["stories"]
+        if len(stories) < 3 and all(s["model"] != model for s in stories):
+            stories.append({"model": model, "story": story if isinstance(story, str) else ""})
+
+    # Bảng đã theo thứ tự dòng TSV → câu đầu tiên của mỗi loại thuộc model đầu tiên có dữ liệu hợp lệ
+    for row in mcq_table[MCQ_COLUMNS].to_dict("records"):
+        entry = index.get(row["doctrine"])
+        if entry is not None and entry["mcqs"][row["type"]] is None:
+            entry["mcqs"][row["type"]] = {
+                "type": row["type"],
+                "question": row["question"],
+                "options": list(row["options"]),
+                "answer": row["answer"],
+            }
+    return index
+
+
+_index_lock = threading.Lock()
+_index_state = {"signature": None, "index": {}}
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
 
-# Đọc dữ liệu MCQ đã tạo
-df = pd.read_csv(DATA_PATH, sep='\t')
+def get_doctrine_index():
+    """Trả về index hiện tại; dựng lại nếu file TSV/Parquet đã thay đổi trên đĩa."""
+    signature = tuple(_file_signature(p) for p in (DATA_PATH, PARQUET_PATH, TABLE_PATH))
+    if signature != _index_state["signature"]:
+        with _index_lock:
+            if signature != _index_state["signature"]:
+                started = time.perf_counter()
+                with phase("load_stories"):
+                    stories_df = load_mcq_dataset(["doctrine", "model", "story"], DATA_PATH, PARQUET_PATH)
+                with phase("load_mcq_table"):
+                    mcq_table = load_mcq_table(MCQ_COLUMNS + ["status"], DATA_PATH, TABLE_PATH)
+                    mcq_table = mcq_table[mcq_table["status"] == "ok"]
+                with phase("build_index"):
+                    _index_state["index"] = build_doctrine_index(stories_df, mcq_table)
+                _index_state["signature"] = signature
+                startup_report["data_load_seconds"] = round(time.perf_counter() - started, 4)
+                startup_report["data_loaded_at"] = time.time()
+    return _index_state["index"]
 
-# Tạo file đánh giá nếu chưa có
-if not os.path.exists(EVAL_PATH):
-    pd.DataFrame(columns=[
-        "doctrine", "voted_model", 
-        "concept_correct", "ending_correct", "limitation_correct", "mcq_total_correct",
-        "is_native", "with_story", "error_type", "rod", "ros", 
-        "likeable", "believable"
-    ]).to_csv(EVAL_PATH, index=False)
+
+def list_doctrines():
+    """Danh sách doctrine cho /: dùng index nếu đã nạp, nếu không thì đọc manifest nhỏ."""
+    if _index_state["signature"] is None:
+        with phase("load_manifest"):
+            doctrines = load_manifest(DATA_PATH, MANIFEST_PATH)
+        if doctrines is not None:
+            startup_report["index_source"] = "manifest"
+            return doctrines
+    startup_report["index_source"] = "index"
+    return list(get_doctrine_index())
+
+
+if STARTUP_MODE == "eager":
+    get_doctrine_index()
+
+# Nơi lưu đánh giá (append-only, tự tạo file nếu chưa có)
+store = get_store(EVAL_PATH)
+
+# Vẽ lại biểu đồ ở background; submit chỉ cần báo hiệu
+plot_regen = PlotRegenerator(before_run=lambda: store.export_csv(EVAL_PATH),
+                             after_run=metrics.observe_plot_regen)
+
+# Thống kê cho /result, đọc store ở lần refresh() đầu tiên
+aggregates = EvalAggregates(store)
+
+# ==== /next: giao (doctrine, thứ tự story) có ít đánh giá nhất ====
+# NEXT_RANDOMIZE=1: chọn ngẫu nhiên giữa các slot bằng số đánh giá
+# NEXT_LEASE_SECONDS: slot vừa giao qua /next được tính như đã có thêm 1 đánh giá
+# cho tới khi nộp (form gửi kèm lease id) hoặc hết khoảng này
+NEXT_RANDOMIZE = os.getenv("NEXT_RANDOMIZE", "0").lower() in ("1", "true", "yes")
+NEXT_LEASE_SECONDS = float(os.getenv("NEXT_LEASE_SECONDS", "300"))
+_scheduler_lock = threading.Lock()
+_scheduler_state = {"signature": None, "scheduler": None}
+
+
+def get_scheduler():
+    """Scheduler theo index hiện tại; dựng lại (đọc lại store) khi dữ liệu doctrine đổi."""
+    index = get_doctrine_index()
+    signature = _index_state["signature"]
+    with _scheduler_lock:
+        if _scheduler_state["signature"] != signature:
+            models = {d: [s["model"] for s in entry["stories"]] for d, entry in index.items() if entry["stories"]}
+            _scheduler_state["scheduler"] = CoverageScheduler(store, models, randomize=NEXT_RANDOMIZE,
+                                                              lease_seconds=NEXT_LEASE_SECONDS)
+            _scheduler_state["signature"] = signature
+    return _scheduler_state["scheduler"]
+
+
+def ordered_stories(stories, order):
+    """Sắp story theo ?order=m1,m2,m3 (từ /next); order không khớp các model thì giữ nguyên."""
+    models = order.split(",") if order else []
+    if sorted(models) != sorted(s["model"] for s in stories):
+        return stories
+    by_model = {s["model"]: s for s in stories}
+    return [by_model[m] for m in models]
+
+
+startup_report["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 4)
+print(f"[⏱️] app.py imported in {startup_report['import_seconds']:.3f}s (startup mode: {STARTUP_MODE})")
 
 
 @app.route("/")
 def index():
-    doctrines = df["doctrine"].unique().tolist()
-    return render_template("index.html", doctrines=doctrines)
+    doctrines = list_doctrines()
+    with phase("render"):
+        return render_template("index.html", doctrines=doctrines)
 
 
 @app.route("/evaluate/<doctrine>", methods=["GET", "POST"])
 def evaluate(doctrine):
-    rows = df[df["doctrine"] == doctrine]
-
-    # Lấy 3 story từ 3 model khác nhau
-    stories = []
-    seen_models = set()
-    for _, row in rows.iterrows():
-        model = row["model"]
-        if model not in seen_models:
-            stories.append({
-                "model": model,
-                "story": row["story"]
-            })
-            seen_models.add(model)
-        if len(stories) == 3:
-            break
-
-    # Lấy MCQs từ model đầu tiên có dữ liệu hợp lệ
-    mcqs_by_type = {"concept": None, "ending": None, "limitation": None}
-    for _, row in rows.iterrows():
-        try:
-            mcqs = json.loads(row["mcqs_json"])
-            for q in mcqs:
-                qtype = q.get("type", "").lower()
-                if qtype in mcqs_by_type and mcqs_by_type[qtype] is None:
-                    mcqs_by_type[qtype] = q
-            if all(mcqs_by_type.values()):
-                break
-        except Exception:
-            continue
+    with phase("index_lookup"):
+        entry = get_doctrine_index().get(doctrine, {})
+    stories = ordered_stories(entry.get("stories", []), request.args.get("order", ""))
+    mcqs_by_type = entry.get("mcqs", {t: None for t in MCQ_TYPES})
 
     if request.method == "POST":
         form = request.form
@@ -86,76 +193,152 @@ def evaluate(doctrine):
             "ros": float(form.get("ros", 0.0)),
             "likeable": int(form.get("likeable", 0)),
             "believable": int(form.get("believable", 0)),
+            "model_order": form.get("model_order", ""),
         }
 
-        df_eval = pd.read_csv(EVAL_PATH)
-        df_eval = pd.concat([df_eval, pd.DataFrame([new_data])])
-        df_eval.to_csv(EVAL_PATH, index=False)
-
-        os.system("python analyze.py")  # nếu có script phân tích
+        with phase("store_append"):
+            store.append(new_data)
+        with phase("aggregates_refresh"):
+            aggregates.refresh()
+        if _scheduler_state["scheduler"] is not None:
+            with phase("schedule"):
+                if form.get("lease"):
+                    _scheduler_state["scheduler"].release(form.get("lease"))
+                _scheduler_state["scheduler"].refresh()
+        plot_regen.signal()  # analyze.py sẽ chạy ở background
         return redirect(url_for("result"))
 
-    return render_template(
-        "evaluate.html", 
-        doctrine=doctrine, 
-        stories=stories, 
-        mcqs=mcqs_by_type
+    with phase("render"):
+        return render_template(
+            "evaluate.html", 
+            doctrine=doctrine, 
+            stories=stories, 
+            mcqs=mcqs_by_type,
+            model_order=order_key(s["model"] for s in stories),
+            lease=request.args.get("lease", "")
+        )
+
+
+@app.route("/next")
+def next_assignment():
+    """Chuyển tới doctrine + thứ tự story đang có ít đánh giá nhất."""
+    with phase("schedule"):
+        assignment = get_scheduler().next()
+    if assignment is None:
+        return redirect(url_for("index"))
+    return redirect(url_for("evaluate", doctrine=assignment["doctrine"], order=order_key(assignment["order"]),
+                            lease=assignment["lease"]))
+
+
+@app.route("/api/next")
+def next_assignment_json():
+    """Chỉ đọc: slot /next sẽ giao tiếp theo + độ phủ (không mở lease, dashboard gọi liên tục được)."""
+    with phase("schedule"):
+        scheduler = get_scheduler()
+        assignment = scheduler.peek()
+    if assignment is not None:
+        assignment["url"] = url_for("next_assignment")
+    return jsonify({"assignment": assignment, "coverage": scheduler.coverage()})
+
+
+# ==== Ảnh kết quả: manifest do analyze.py ghi (tên file có hash nội dung) ====
+PLOT_DIR = "static/plots"
+PLOT_MANIFEST_PATH = os.path.join(PLOT_DIR, "manifest.json")
+PLOT_MAX_AGE = 365 * 24 * 3600
+_plot_manifest_state = {"signature": None, "manifest": None}
+
+
+def get_plot_manifest():
+    """Manifest ảnh, chỉ đọc lại khi file đổi; chưa có manifest (analyze.py chưa chạy) thì quét thư mục."""
+    signature = _file_signature(PLOT_MANIFEST_PATH)
+    if signature is not None and signature == _plot_manifest_state["signature"]:
+        return _plot_manifest_state["manifest"]
+    if signature is not None:
+        try:
+            with open(PLOT_MANIFEST_PATH) as f:
+                manifest = json.load(f)
+            _plot_manifest_state.update(signature=signature, manifest=manifest)
+            return manifest
+        except (OSError, ValueError):
+            pass
+    names = sorted(
+        f for f in os.listdir(PLOT_DIR)
+        if f.endswith(".png") and os.path.isfile(os.path.join(PLOT_DIR, f))
     )
+    version = hashlib.sha1(json.dumps([(n, _file_signature(os.path.join(PLOT_DIR, n))) for n in names]).encode()).hexdigest()
+    return {"version": "scan-" + version[:16], "images": [{"name": n} for n in names]}
+
+
+def plot_url(image):
+    if "file" in image:
+        return url_for("plot_file", filename=image["file"])
+    return url_for("static", filename="plots/" + image["name"])
+
+
+@app.route("/plots/<path:filename>")
+def plot_file(filename):
+    # Tên file đã chứa hash nội dung → không bao giờ đổi, cache 1 năm
+    response = send_from_directory(os.path.join(PLOT_DIR, "v"), filename, max_age=PLOT_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# ==== /result: ETag theo generation của store + phiên bản ảnh ====
+# Đổi template khi deploy cũng phải đổi ETag
+RESULT_TEMPLATE_SIGNATURE = _file_signature(os.path.join(app.root_path, "templates", "result.html"))
+
+
+def result_etag(plot_status, manifest):
+    key = [store.generation(), manifest["version"], RESULT_TEMPLATE_SIGNATURE,
+           plot_status["running"], plot_status["pending"], plot_status["last_run_ok"],
+           plot_status["data_as_of"], plot_status["pending_since"]]
+    return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def _revalidate(response, etag):
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # luôn hỏi lại, nhưng chỉ nhận 304 nếu không đổi
+    return response
 
 
 @app.route("/result")
 def result():
-    df_eval = pd.read_csv(EVAL_PATH)
-    total_votes = len(df_eval)
-
-    # ====== Thống kê số phiếu bầu ======
-    model_votes = df_eval["voted_model"].value_counts().to_dict()
-    model_votes_pct = df_eval["voted_model"].value_counts(normalize=True).mul(100).round(2).to_dict()
-
-    # ====== Accuracy trung bình từng loại ======
-    concept_acc = df_eval["concept_correct"].mean() * 100 if total_votes > 0 else 0
-    ending_acc = df_eval["ending_correct"].mean() * 100 if total_votes > 0 else 0
-    limitation_acc = df_eval["limitation_correct"].mean() * 100 if total_votes > 0 else 0
-
-    # ====== MCQ Accuracy overall ======
-    if total_votes > 0:
-        mcq_acc = df_eval[["concept_correct", "ending_correct", "limitation_correct"]].mean().mean() * 100
-    else:
-        mcq_acc = 0
-
-    # ====== Accuracy tổng hợp theo model ======
-    if total_votes > 0:
-        model_acc = (
-            df_eval.groupby("voted_model")[["concept_correct", "ending_correct", "limitation_correct"]]
-            .mean()
-            .mean(axis=1)   # lấy trung bình cả 3 loại
-            .mul(100)
-            .round(2)
-            .to_dict()
-        )
-    else:
-        model_acc = {}
+    with phase("etag"):
+        plot_status = plot_regen.status()
+        manifest = get_plot_manifest()
+        etag = result_etag(plot_status, manifest)
+    if request.if_none_match.contains(etag):
+        return _revalidate(app.response_class(status=304), etag)
+
+    # ====== Thống kê cập nhật dần (không đọc lại toàn bộ đánh giá) ======
+    with phase("aggregates_refresh"):
+        stats = aggregates.refresh().snapshot()
 
     # ====== Lấy ảnh kết quả ======
-    plot_folder = "static/plots"
-    all_images = [
-        f for f in os.listdir(plot_folder)
-        if f.endswith(".png") and os.path.isfile(os.path.join(plot_folder, f))
-    ]
-
-    return render_template(
-        "result.html",
-        total_votes=total_votes,
-        model_votes=model_votes,
-        model_votes_pct=model_votes_pct,
-        mcq_acc=round(mcq_acc, 2),
-        concept_acc=round(concept_acc, 2),
-        ending_acc=round(ending_acc, 2),
-        limitation_acc=round(limitation_acc, 2),
-        model_acc=model_acc,
-        all_images=all_images
-    )
+    all_images = [{"name": image["name"], "url": plot_url(image)} for image in manifest["images"]]
+
+    with phase("render"):
+        response = make_response(render_template(
+            "result.html",
+            all_images=all_images,
+            plot_status=plot_status,
+            **stats
+        ))
+    return _revalidate(response, etag)
+
+
+@app.route("/api/result")
+def result_json():
+    etag = hashlib.sha1(str(store.generation()).encode("utf-8")).hexdigest()
+    if request.if_none_match.contains(etag):
+        return _revalidate(app.response_class(status=304), etag)
+    return _revalidate(jsonify(aggregates.refresh().snapshot()), etag)
+
 
+@app.route("/api/startup")
+def startup_json():
+    return jsonify(startup_report)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+import json
+import re
+import threading
+
+# Gộp K doctrine / K story vào 1 request (structured output), tách phản hồi về
+# từng item; item nào hỏng thì script gọi lại riêng item đó (fallback).
+
+ITEM_HEADER = "### Item {id}"
+ITEM_HEADER_RE = re.compile(r"^### Item (\S+)\s*$", re.MULTILINE)
+
+
+def chunked(items, size):
+    """Chia 1 iterable (kể cả generator) thành các list tối đa `size` phần tử."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def batch_prompt(task, items, field, field_hint):
+    """Prompt cho K item: task chung + từng item có tiêu đề '### Item <id>'.
+
+    items: list (id, nội dung item); phản hồi phải là {"items": [{"id", field}]}.
+    """
+    parts = [task.strip(), ""]
+    for item_id, text in items:
+        parts += [ITEM_HEADER.format(id=item_id), text.strip(), ""]
+    parts.append(
+        f'Return ONLY a JSON object of the form {{"items": [{{"id": "<item id>", "{field}": {field_hint}}}]}} '
+        f"with exactly one entry per item above, using the same ids. Do not add any other text."
+    )
+    return "\n".join(parts)
+
+
+def split_batch(content, field):
+    """Phản hồi batch → {id: giá trị field}; phản hồi hỏng thì trả {} (mọi item sẽ fallback)."""
+    content = content.strip()
+    content = re.sub(r"^```(json)?", "", content, flags=re.IGNORECASE).strip()
+    content = re.sub(r"```$", "", content).strip()
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        return {}
+    items = parsed.get("items") if isinstance(parsed, dict) else parsed
+    if not isinstance(items, list):
+        return {}
+    return {str(item["id"]): item.get(field) for item in items if isinstance(item, dict) and "id" in item}
+
+
+class BatchStats:
+    """Đếm item / request (kể cả fallback) để báo số request tiết kiệm được so với K=1."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.items = 0
+        self.requests = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def add(self, items, fallbacks=0):
+        """1 nhóm `items` item: 1 request (batch hoặc đơn lẻ) + `fallbacks` request gọi lại từng item."""
+        with self._lock:
+            self.items += items
+            self.requests += 1 + fallbacks
+            self.fallbacks += fallbacks
+
+    def report(self, elapsed=None):
+        if self.batch_size <= 1:
+            return
+        print(f"\n📦 Batching (K={self.batch_size}):")
+        print(f"  Items:                  {self.items}")
+        print(f"  Requests:               {self.requests} (incl. {self.fallbacks} single-item fallbacks)")
+        if self.requests:
+            print(f"  Requests saved vs K=1:  {self.items - self.requests}"
+                  f" ({self.items / self.requests:.2f} items/request)")
+        if elapsed:
+            print(f"  Throughput:             {self.items / elapsed:.2f} items/s")
@@ -0,0 +1,143 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from mock_openrouter import CANNED_STORY, base_url, make_server
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STORY_MODELS = ["mistral", "llama3", "gpt35"]
+
+# Các chế độ sinh được đo: (lệnh, số item mỗi doctrine)
+MODES = {
+    "main-sync": (lambda a: ["main.py", "--model", "mistral", "--no-cache"], 1),
+    "main-async": (lambda a: ["main.py", "--model", "mistral", "--no-cache", "--async",
+                              "--concurrency", str(a.concurrency)], 1),
+    "main-stream": (lambda a: ["main.py", "--model", "mistral", "--no-cache", "--async", "--stream",
+                               "--concurrency", str(a.concurrency), "--max-words", str(a.max_words)], 1),
+    "mcq-threads": (lambda a: ["generate_mcq.py", "--no-cache", "--workers", str(a.workers)], len(STORY_MODELS)),
+}
+
+
+def make_workspace(root, n_doctrines):
+    """Đầu vào giả cho main.py (danh sách doctrine) và generate_mcq.py (merged_stories.tsv)."""
+    os.makedirs(os.path.join(root, "data"), exist_ok=True)
+    os.makedirs(os.path.join(root, "outputs"), exist_ok=True)
+    doctrines = [f"Doctrine {i:06d}" for i in range(n_doctrines)]
+    with open(os.path.join(root, "data/legal_doctrines_294.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["doctrine", "definition"])
+        writer.writerows((d, f"Definition of {d}.") for d in doctrines)
+    with open(os.path.join(root, "outputs/merged_stories.tsv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(["doctrine", "definition"] + [f"{m}_story" for m in STORY_MODELS])
+        writer.writerows([d, f"Definition of {d}."] + [CANNED_STORY] * len(STORY_MODELS) for d in doctrines)
+
+
+def run_mode(name, args, root, server, env, batch_size=1):
+    build_cmd, items_per_doctrine = MODES[name]
+    script, *script_args = build_cmd(args)
+    script_args += ["--batch-size", str(batch_size)]
+    server.stats.reset()
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.join(REPO_DIR, script)] + script_args,
+                          cwd=root, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    stats = server.stats.snapshot()
+    items = args.doctrines * items_per_doctrine
+    result = {
+        "batch_size": batch_size,
+        "returncode": proc.returncode,
+        "wall_seconds": wall,
+        "items": items,
+        "items_per_second": items / wall,
+        "requests": stats["requests"],
+        "requests_per_second": stats["requests"] / wall,
+        "items_per_request": items / stats["requests"] if stats["requests"] else None,
+        "retries": stats["requests"] - stats["statuses"].get("200", 0),
+        "statuses": stats["statuses"],
+        # Độ trễ đo ở server (gồm độ trễ giả lập), không gồm thời gian chờ backoff phía client
+        "latency_p50": stats["latency_p50"],
+        "latency_p99": stats["latency_p99"],
+        "max_in_flight": stats["max_in_flight"],
+    }
+    if proc.returncode != 0:
+        result["error"] = proc.stderr.strip().splitlines()[-3:]
+    return result
+
+
+def main(args):
+    server = make_server(port=0, latency=args.latency, rate_429=args.rate_429, rate_5xx=args.rate_5xx,
+                         retry_after=args.retry_after, canned=args.canned, seed=args.seed,
+                         batch_drop=args.batch_drop, token_latency=args.token_latency, runaway=args.runaway)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = {**os.environ, "OPENAI_BASE": base_url(server), "OPENAI_API_KEY": "mock-key", "LLM_CACHE": "off"}
+
+    report = {"created_at": time.time(), "server": {
+        "latency": args.latency, "rate_429": args.rate_429, "rate_5xx": args.rate_5xx,
+        "retry_after": args.retry_after, "batch_drop": args.batch_drop,
+        "token_latency": args.token_latency, "runaway": args.runaway}, "doctrines": args.doctrines, "modes": {}}
+    root = tempfile.mkdtemp(prefix="bench-gen-")
+    try:
+        make_workspace(root, args.doctrines)
+        for name in args.modes:
+            baseline = None
+            for k in args.batch_sizes:
+                # K=1 giữ tên chế độ như cũ để so sánh được với các file kết quả trước
+                key = name if k == 1 else f"{name}@k{k}"
+                print(f"[🚀] {key}")
+                result = run_mode(name, args, root, server, env, batch_size=k)
+                baseline = baseline or result
+                # Mức lợi so với lần chạy đầu tiên của chế độ này (K nhỏ nhất trong --batch-sizes)
+                result["request_reduction"] = baseline["requests"] / result["requests"] if result["requests"] else None
+                result["throughput_gain"] = result["items_per_second"] / baseline["items_per_second"]
+                report["modes"][key] = result
+                mark = "✓" if result["returncode"] == 0 else "✗"
+                print(f"    [{mark}] {result['wall_seconds']:.2f}s | {result['requests']} requests"
+                      f" ({result['requests_per_second']:.1f} req/s) | {result['items_per_second']:.1f} items/s"
+                      f" | p50 {result['latency_p50'] or 0:.3f}s | p99 {result['latency_p99'] or 0:.3f}s"
+                      f" | retries {result['retries']} | max in flight {result['max_in_flight']}")
+                if result is not baseline:
+                    print(f"    vs K={baseline['batch_size']}: {result['request_reduction'] or 0:.2f}x fewer requests,"
+                          f" {result['throughput_gain']:.2f}x items/s")
+    finally:
+        server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Generation benchmark saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo throughput sinh story/MCQ với server OpenRouter giả lập")
+    parser.add_argument("--modes", nargs="*", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--doctrines", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8, help="--concurrency cho main.py --async")
+    parser.add_argument("--workers", type=int, default=8, help="--workers cho generate_mcq.py")
+    parser.add_argument("--latency", default="lognormal:0.3,0.5",
+                        help="fixed:S | uniform:A,B | normal:MEAN,SD | lognormal:MEDIAN,SIGMA | none")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--batch-sizes", type=int, nargs="*", default=[1],
+                        help="Chạy mỗi chế độ với từng --batch-size K, vd. 1 4 8 (so với K đầu tiên)")
+    parser.add_argument("--batch-drop", type=float, default=0.0,
+                        help="Tỉ lệ item server bỏ khỏi phản hồi batch (đo chi phí fallback)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Chế độ stream: giây giữa 2 chunk")
+    parser.add_argument("--runaway", type=float, default=0.0, help="Tỉ lệ phản hồi dài gấp 10 lần")
+    parser.add_argument("--max-words", type=int, default=600, help="--max-words cho main-stream")
+    parser.add_argument("--canned", default=None, help="TSV chứa story/mcqs_json để trả về")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="outputs/bench_generation.json")
+    args = parser.parse_args()
+    args.batch_sizes = sorted(set(args.batch_sizes)) or [1]
+    main(args)
@@ -0,0 +1,247 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Thư mục story theo model → tên model trong merged_mcq.tsv / evaluations.csv
+MODELS = {"mistral": "mistral", "llama3": "llama3", "gpt-3.5": "gpt35"}
+VOTED_MODELS = list(MODELS.values())
+MCQ_TYPES = ["concept", "ending", "limitation"]
+ERROR_TYPES = ["none", "Missing Info", "Multi-Answers", "Too Easy", "Wrong Reasoning"]
+EVAL_FIELDS = [
+    "doctrine", "voted_model", "mcq_correct", "mcq_type",
+    "concept_correct", "ending_correct", "limitation_correct", "mcq_total_correct",
+    "is_native", "with_story", "error_type", "rod", "ros", "likeable", "believable",
+]
+
+# Các script được đo, chạy trong thư mục dữ liệu giả (theo thứ tự phụ thuộc)
+STAGES = [
+    ("merge_stories", "merge_stories.py"),
+    ("evaluate_stories", "evaluate_stories.py"),
+    ("mcq_dataset", "mcq_dataset.py"),
+    ("analyze_mcq", "analyze_mcq.py"),
+    ("analyze", "analyze.py"),
+]
+
+csv.field_size_limit(sys.maxsize)
+
+
+# ==== Dữ liệu giả: nhân bản dữ liệu thật (294 doctrine) lên N doctrine ====
+def load_templates():
+    """Lấy (definition, story theo model, mcqs_json theo model) từ merged_mcq.tsv hiện có."""
+    templates = {}
+    path = os.path.join(REPO_DIR, "outputs/merged_mcq.tsv")
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            entry = templates.setdefault(row["doctrine"], {"definition": row["definition"], "models": {}})
+            entry["models"].setdefault(row["model"], (row["story"], row["mcqs_json"]))
+    return [t for t in templates.values() if all(m in t["models"] for m in VOTED_MODELS)]
+
+
+def make_dataset(root, n_doctrines, templates, evals_per_doctrine=1.0, seed=0):
+    rng = random.Random(seed)
+    doctrines = [f"Doctrine {i:06d}" for i in range(n_doctrines)]
+    picks = [templates[i % len(templates)] for i in range(n_doctrines)]
+
+    os.makedirs(os.path.join(root, "data"), exist_ok=True)
+    os.makedirs(os.path.join(root, "static/plots"), exist_ok=True)
+    with open(os.path.join(root, "data/legal_doctrines_294.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["doctrine", "definition"])
+        writer.writerows((d, t["definition"]) for d, t in zip(doctrines, picks))
+
+    for model, name in MODELS.items():
+        out_dir = os.path.join(root, f"outputs/294-doctrines-{model}")
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, "294_doctrine_stories.tsv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["doctrine", "definition", "story"])
+            writer.writerows((d, t["definition"], t["models"][name][0]) for d, t in zip(doctrines, picks))
+
+    with open(os.path.join(root, "outputs/merged_mcq.tsv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(["doctrine", "definition", "model", "story", "mcqs_json"])
+        for d, t in zip(doctrines, picks):
+            for model in VOTED_MODELS:
+                story, mcqs_json = t["models"][model]
+                writer.writerow([d, t["definition"], model, story, mcqs_json])
+
+    # Đánh giá gồm cả cột cũ (analyze.py) lẫn cột mới (app.py / eval_aggregates)
+    n_evals = max(1, int(n_doctrines * evals_per_doctrine))
+    with open(os.path.join(root, "data/evaluations.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=EVAL_FIELDS)
+        writer.writeheader()
+        for _ in range(n_evals):
+            correct = [rng.randint(0, 1) for _ in MCQ_TYPES]
+            writer.writerow({
+                "doctrine": rng.choice(doctrines), "voted_model": rng.choice(VOTED_MODELS),
+                "mcq_correct": rng.randint(0, 1), "mcq_type": rng.choice(MCQ_TYPES),
+                "concept_correct": correct[0], "ending_correct": correct[1],
+                "limitation_correct": correct[2], "mcq_total_correct": sum(correct),
+                "is_native": rng.randint(0, 1), "with_story": rng.randint(0, 1),
+                "error_type": rng.choice(ERROR_TYPES),
+                "rod": round(rng.random(), 1), "ros": round(rng.random(), 1),
+                "likeable": rng.randint(0, 1), "believable": rng.randint(0, 1),
+            })
+    return doctrines
+
+
+# ==== Đo các route của app.py (chạy trong process con, cwd = thư mục dữ liệu giả) ====
+def summarize(samples):
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {"n": len(ordered), "mean": statistics.fmean(ordered), "p50": pct(50),
+            "p95": pct(95), "max": ordered[-1]}
+
+
+def app_worker(repeats):
+    sys.path.insert(0, REPO_DIR)
+    started = time.perf_counter()
+    import app as webapp
+    import_seconds = time.perf_counter() - started
+    # analyze.py được đo riêng ở phần stage, không để POST kích hoạt vẽ lại ở background
+    webapp.plot_regen.signal = lambda: None
+    client = webapp.app.test_client()
+    doctrines = webapp.list_doctrines()
+    rng = random.Random(0)
+    form = {"voted_model": "mistral", "is_native": "1", "with_story": "1",
+            "answer_concept": "A", "correct_concept": "A", "answer_ending": "B", "correct_ending": "A",
+            "answer_limitation": "A", "correct_limitation": "A", "error_type": "none",
+            "rod": "0.2", "ros": "0.4", "likeable": "1", "believable": "0"}
+
+    routes = {
+        "index": lambda: client.get("/"),
+        "evaluate_get": lambda: client.get(f"/evaluate/{rng.choice(doctrines)}"),
+        "evaluate_post": lambda: client.post(f"/evaluate/{rng.choice(doctrines)}", data=form),
+        "result": lambda: client.get("/result"),
+    }
+    results = {"import_seconds": import_seconds}
+    for name, call in routes.items():
+        samples = []
+        for _ in range(repeats):
+            t = time.perf_counter()
+            response = call()
+            samples.append(time.perf_counter() - t)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name} → HTTP {response.status_code}")
+        # Lần đầu gồm cả chi phí nạp dữ liệu lười → tách riêng
+        results[name] = {"first": samples[0], **summarize(samples[1:] or samples)}
+    results["startup_report"] = webapp.startup_report
+    print(json.dumps(results))
+
+
+def bench_app(root, repeats):
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--app-worker", "--repeats", str(repeats)],
+                          cwd=root, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def bench_stages(root, names):
+    results = {}
+    for name, script in STAGES:
+        if name not in names:
+            continue
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.join(REPO_DIR, script)], cwd=root,
+                              capture_output=True, text=True)
+        results[name] = {"seconds": time.perf_counter() - started, "returncode": proc.returncode}
+        if proc.returncode != 0:
+            results[name]["error"] = proc.stderr.strip().splitlines()[-1:]
+        print(f"    [{'✓' if proc.returncode == 0 else '✗'}] {name}: {results[name]['seconds']:.2f}s")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline_path):
+    """In tỉ lệ thời gian so với 1 file kết quả cũ (>1 là chậm hơn)."""
+    with open(baseline_path) as f:
+        baseline = {r["doctrines"]: r for r in json.load(f)["results"]}
+    print(f"\n==== So với {baseline_path} ====")
+    for result in current["results"]:
+        old = baseline.get(result["doctrines"])
+        if old is None:
+            continue
+        for name, stage in result.get("stages", {}).items():
+            if name in old.get("stages", {}):
+                print(f"  {result['doctrines']:>7} {name:<18} x{stage['seconds'] / old['stages'][name]['seconds']:.2f}")
+        for name, route in result.get("routes", {}).items():
+            old_route = old.get("routes", {}).get(name)
+            if isinstance(route, dict) and isinstance(old_route, dict) and "p50" in route:
+                print(f"  {result['doctrines']:>7} /{name:<17} x{route['p50'] / old_route['p50']:.2f} (p50)")
+
+
+def main(args):
+    templates = load_templates()
+    report = {
+        "commit": git_commit(),
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeats": args.repeats,
+        "results": [],
+    }
+    for size in args.sizes:
+        print(f"[📦] {size} doctrines")
+        root = tempfile.mkdtemp(prefix=f"bench-{size}-")
+        try:
+            started = time.perf_counter()
+            make_dataset(root, size, templates, args.evals_per_doctrine)
+            result = {"doctrines": size, "dataset_seconds": time.perf_counter() - started}
+            result["stages"] = bench_stages(root, [n for n, _ in STAGES if n not in args.skip])
+            # Đo app sau các stage: có sẵn manifest/Parquet và ảnh như khi chạy thật
+            if "app" not in args.skip:
+                result["routes"] = bench_app(root, args.repeats)
+            report["results"].append(result)
+        finally:
+            if not args.keep:
+                shutil.rmtree(root, ignore_errors=True)
+            else:
+                print(f"    dữ liệu giữ lại tại {root}")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Benchmark results saved to: {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo app.py và các bước pipeline trên dữ liệu giả")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[294, 1000, 10000, 100000],
+                        help="Số doctrine của từng bộ dữ liệu giả")
+    parser.add_argument("--repeats", type=int, default=50, help="Số request cho mỗi route")
+    parser.add_argument("--evals-per-doctrine", type=float, default=1.0)
+    parser.add_argument("--skip", nargs="*", default=[],
+                        help="Bỏ qua: app " + " ".join(name for name, _ in STAGES))
+    parser.add_argument("--output", default="outputs/benchmark.json")
+    parser.add_argument("--compare", default=None, help="File JSON cũ để so sánh")
+    parser.add_argument("--keep", action="store_true", help="Giữ lại thư mục dữ liệu giả")
+    parser.add_argument("--app-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.app_worker:
+        app_worker(args.repeats)
+    else:
+        main(args)
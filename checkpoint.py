@@ -0,0 +1,75 @@
+import csv
+import os
+import sys
+import threading
+
+# Story/definition có thể rất dài
+csv.field_size_limit(sys.maxsize)
+
+
+def line_terminator(path, default="\r\n"):
+    """Kiểu xuống dòng của file có sẵn (theo dòng header), để ghi nối không bị lẫn \r\n và \n."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return default
+    with open(path, "rb") as f:
+        first = f.readline()
+    if first.endswith(b"\r\n"):
+        return "\r\n"
+    return "\n" if first.endswith(b"\n") else default
+
+
+def load_checkpoint(path, key_columns, is_complete=None, delimiter="\t", lineterminator=None):
+    """Đọc file output của lần chạy trước để chạy tiếp (--resume).
+
+    Giữ lại các dòng đã hoàn thành (is_complete(row) là True). Chỉ ghi đè file
+    khi có dòng lỗi bị bỏ (hoặc dòng cuối thiếu xuống dòng), giữ nguyên kiểu
+    xuống dòng của file. Trả về tập key (tuple theo key_columns) đã xong.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return set()
+
+    with open(path, encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        fieldnames = reader.fieldnames
+        total = 0
+        kept = []
+        for row in reader:
+            total += 1
+            if is_complete is None or is_complete(row):
+                kept.append(row)
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        ends_with_newline = f.read(1) == b"\n"
+
+    if len(kept) < total or not ends_with_newline:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=delimiter,
+                                    lineterminator=lineterminator or line_terminator(path))
+            writer.writeheader()
+            writer.writerows(kept)
+        os.replace(tmp_path, path)
+    return {tuple(row[c] for c in key_columns) for row in kept}
+
+
+class RunSummary:
+    """Đếm các đơn vị (doctrine, model) đã bỏ qua / thử lại / sinh mới / lỗi."""
+
+    def __init__(self):
+        self.skipped = 0
+        self.produced = 0
+        self.failed = 0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def on_retry(self, *_):
+        # Có thể được gọi từ nhiều thread / task cùng lúc
+        with self._lock:
+            self.retried += 1
+
+    def report(self, title="Run summary"):
+        print(f"\n📋 {title}:")
+        print(f"  Skipped (already done): {self.skipped}")
+        print(f"  Newly produced:         {self.produced}")
+        print(f"  Retried requests:       {self.retried}")
+        print(f"  Failed:                 {self.failed}")
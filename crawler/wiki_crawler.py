@@ -1,6 +1,14 @@
 import csv
-import wikipedia
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import wikipedia
+
+CACHE_DIR = ".cache/wiki"
+
 
 def load_doctrine_names(csv_path):
     doctrines = []
@@ -12,26 +20,88 @@ def load_doctrine_names(csv_path):
                 doctrines.append(doctrine)
     return doctrines
 
-def crawl_definitions(doctrine_list, output_csv):
-    results = []
-    for doctrine in doctrine_list:
+
+# ==== Lớp fetch: có thể thay bằng hàm giả để test / benchmark ====
+def wiki_fetch(title):
+    return wikipedia.summary(title, auto_suggest=False)
+
+
+def is_transient(exc):
+    """Lỗi mạng/timeout thì thử lại; PageError, DisambiguationError thì không."""
+    if isinstance(exc, (wikipedia.exceptions.PageError, wikipedia.exceptions.DisambiguationError)):
+        return False
+    if isinstance(exc, wikipedia.exceptions.HTTPTimeoutError):
+        return True
+    return isinstance(exc, (OSError, TimeoutError)) or "requests.exceptions" in type(exc).__module__
+
+
+class TitleCache:
+    """Cache từng trang trên đĩa: 1 file JSON cho mỗi title."""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, title):
+        return os.path.join(self.cache_dir, hashlib.sha1(title.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, title):
+        try:
+            with open(self._path(title), encoding="utf-8") as f:
+                return json.load(f)["summary"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, title, summary):
+        path = self._path(title)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"title": title, "summary": summary}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def fetch_with_retry(doctrine, fetch, cache, max_retries=3, base_delay=1.0):
+    if cache is not None:
+        summary = cache.get(doctrine)
+        if summary is not None:
+            return summary
+    for attempt in range(max_retries + 1):
         try:
-            summary = wikipedia.summary(doctrine, auto_suggest=False)
-            print(f"[✓] {doctrine}")
-            results.append({"doctrine": doctrine, "definition": summary})
+            summary = fetch(doctrine)
+            break
         except Exception as e:
-            print(f"[✗] Failed: {doctrine} → {e}")
-    
+            if attempt == max_retries or not is_transient(e):
+                raise
+            time.sleep(base_delay * (2 ** attempt))
+    if cache is not None:
+        cache.put(doctrine, summary)
+    return summary
+
+
+def crawl_definitions(doctrine_list, output_csv, fetch=wiki_fetch, workers=8, cache=None, max_retries=3):
+    """Crawl song song; ghi từng dòng ra CSV (theo thứ tự doctrine_list) ngay khi xong."""
+    def task(doctrine):
+        try:
+            return doctrine, fetch_with_retry(doctrine, fetch, cache, max_retries), None
+        except Exception as e:
+            return doctrine, None, e
+
     os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-    with open(output_csv, mode='w', encoding='utf-8', newline='') as f:
+    with open(output_csv, mode='w', encoding='utf-8', newline='') as f, \
+         ThreadPoolExecutor(workers) as pool:
         writer = csv.DictWriter(f, fieldnames=["doctrine", "definition"])
         writer.writeheader()
-        for row in results:
-            writer.writerow(row)
+        # pool.map trả kết quả theo thứ tự đầu vào, ngay khi phần đầu đã xong
+        for doctrine, summary, error in pool.map(task, doctrine_list):
+            if error is None:
+                print(f"[✓] {doctrine}")
+                writer.writerow({"doctrine": doctrine, "definition": summary})
+                f.flush()
+            else:
+                print(f"[✗] Failed: {doctrine} → {error}")
 
 if __name__ == "__main__":
     doctrine_csv = "complex-law-doctrine-list.csv"
     output_path = "../data/legal_doctrines_294.csv"
     doctrine_list = load_doctrine_names(doctrine_csv)
-    crawl_definitions(doctrine_list, output_path)
-
+    crawl_definitions(doctrine_list, output_path, cache=TitleCache())
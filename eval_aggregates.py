@@ -0,0 +1,99 @@
+import math
+import threading
+
+MCQ_COLUMNS = ("concept_correct", "ending_correct", "limitation_correct")
+
+
+def _number(value):
+    """Giá trị số hoặc None nếu trống/NaN (pandas bỏ qua NaN khi tính mean)."""
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+class EvalAggregates:
+    """Thống kê cho /result, cập nhật dần theo từng đánh giá mới.
+
+    refresh() chỉ đọc các dòng được ghi sau lần đọc trước (kể cả của worker
+    khác) qua store.read_since, nên mỗi đánh giá chỉ tốn O(1). Khởi tạo không
+    đọc store (import app.py không tốn thêm theo số đánh giá); lần refresh()
+    đầu tiên mới đọc toàn bộ.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self.total_votes = 0
+        self.model_votes = {}
+        # cột → [tổng, số dòng có giá trị]
+        self.column_sums = {c: [0.0, 0] for c in MCQ_COLUMNS}
+        # model → cột → [tổng, số dòng có giá trị]
+        self.model_sums = {}
+
+    def add(self, row):
+        self.total_votes += 1
+        model = row.get("voted_model")
+        if model is not None and model != "":
+            self.model_votes[model] = self.model_votes.get(model, 0) + 1
+        for column in MCQ_COLUMNS:
+            value = _number(row.get(column))
+            if value is None:
+                continue
+            self.column_sums[column][0] += value
+            self.column_sums[column][1] += 1
+            if model is not None and model != "":
+                sums = self.model_sums.setdefault(model, {c: [0.0, 0] for c in MCQ_COLUMNS})
+                sums[column][0] += value
+                sums[column][1] += 1
+
+    def refresh(self):
+        with self._lock:
+            if self.store.generation() == self._cursor:
+                return self  # không có đánh giá mới
+            rows, self._cursor = self.store.read_since(self._cursor)
+            for row in rows:
+                self.add(row)
+        return self
+
+    @staticmethod
+    def _mean(pair):
+        total, count = pair
+        return total / count if count else None
+
+    def snapshot(self):
+        """Các số liệu /result cần, tính từ bộ đếm (không đọc lại dữ liệu)."""
+        with self._lock:
+            total_votes = self.total_votes
+            counted = sum(self.model_votes.values())
+            # Thứ tự giống value_counts(): nhiều phiếu trước
+            model_votes = dict(sorted(self.model_votes.items(), key=lambda kv: -kv[1]))
+            model_votes_pct = {
+                m: round(n / counted * 100, 2) for m, n in model_votes.items()
+            }
+
+            type_acc = {c: self._mean(self.column_sums[c]) for c in MCQ_COLUMNS}
+            known = [v for v in type_acc.values() if v is not None]
+            mcq_acc = sum(known) / len(known) * 100 if known else 0
+
+            model_acc = {}
+            for model in sorted(self.model_sums):
+                means = [self._mean(p) for p in self.model_sums[model].values()]
+                means = [m for m in means if m is not None]
+                if means:
+                    model_acc[model] = round(sum(means) / len(means) * 100, 2)
+
+        return {
+            "total_votes": total_votes,
+            "model_votes": model_votes,
+            "model_votes_pct": model_votes_pct,
+            "mcq_acc": round(mcq_acc, 2),
+            "concept_acc": round((type_acc["concept_correct"] or 0) * 100, 2),
+            "ending_acc": round((type_acc["ending_correct"] or 0) * 100, 2),
+            "limitation_acc": round((type_acc["limitation_correct"] or 0) * 100, 2),
+            "model_acc": model_acc,
+        }
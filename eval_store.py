@@ -0,0 +1,269 @@
+import csv
+import io
+import os
+import sqlite3
+import threading
+
+from checkpoint import line_terminator
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá được trong cùng process
+    fcntl = None
+
+# Schema CSV mà app.py ghi và analyze.py đọc
+EVAL_COLUMNS = [
+    "doctrine", "voted_model",
+    "concept_correct", "ending_correct", "limitation_correct", "mcq_total_correct",
+    "is_native", "with_story", "error_type", "rod", "ros",
+    "likeable", "believable", "model_order"
+]
+TEXT_COLUMNS = {"doctrine", "voted_model", "error_type", "mcq_type", "model_order"}
+
+
+def _coerce(value, column):
+    """Chuyển giá trị đọc từ CSV (chuỗi) về số như pandas vẫn làm."""
+    if value is None or value == "":
+        return None
+    if column in TEXT_COLUMNS:
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    return int(number) if number.is_integer() and "." not in str(value) else number
+
+
+class _FileLock:
+    """Khoá file liên process (flock) + khoá thread trong cùng process."""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        self._fh = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        self._fh.close()
+        self._thread_lock.release()
+
+
+class EvalStore:
+    """Giao diện chung cho nơi lưu đánh giá.
+
+    - append(row): ghi 1 đánh giá, O(1)
+    - read_since(cursor): đọc các dòng mới kể từ cursor → (rows, cursor mới)
+    - export_csv(path): xuất ra CSV đúng schema cho analyze.py
+    - generation(): số tăng mỗi khi có đánh giá mới, không đọc dữ liệu
+      (bằng cursor sau khi read_since đọc hết; dùng cho ETag của /result)
+    """
+
+    def append(self, row):
+        raise NotImplementedError
+
+    def read_since(self, cursor=0):
+        raise NotImplementedError
+
+    def export_csv(self, path):
+        raise NotImplementedError
+
+    def generation(self):
+        raise NotImplementedError
+
+    def read_all(self):
+        rows, _ = self.read_since(0)
+        return rows
+
+
+class CsvAppendStore(EvalStore):
+    """Append-only log dạng CSV, ghi dưới flock nên nhiều worker không mất dòng."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = _FileLock(path + ".lock")
+        with self._lock:
+            # Giữ kiểu xuống dòng của file có sẵn (file pandas ghi dùng \n), file mới dùng \n
+            self.lineterminator = line_terminator(path, "\n")
+            self.columns = self._ensure_header()
+
+    def _ensure_header(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, "w", encoding="utf-8", newline="") as f:
+                csv.writer(f, lineterminator=self.lineterminator).writerow(EVAL_COLUMNS)
+            return list(EVAL_COLUMNS)
+
+        with open(self.path, encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            missing = [c for c in EVAL_COLUMNS if c not in header]
+            if not missing:
+                return header
+            # File cũ có schema khác: chuyển đổi 1 lần (giống pd.concat trước đây)
+            rows = list(reader)
+
+        columns = header + missing
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, lineterminator=self.lineterminator)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row + [""] * (len(columns) - len(row)))
+        os.replace(tmp_path, self.path)
+        return columns
+
+    def append(self, row):
+        line = io.StringIO()
+        csv.writer(line, lineterminator=self.lineterminator).writerow(["" if row.get(c) is None else row.get(c) for c in self.columns])
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                f.write(line.getvalue())
+
+    def read_since(self, cursor=0):
+        with self._lock:
+            with open(self.path, "rb") as f:
+                f.seek(cursor)
+                data = f.read()
+        new_cursor = cursor + len(data)
+        reader = csv.reader(io.StringIO(data.decode("utf-8"), newline=""))
+        if cursor == 0:
+            header = next(reader, None)
+            if header:
+                self.columns = header
+        rows = [
+            {c: _coerce(v, c) for c, v in zip(self.columns, values)}
+            for values in reader if values
+        ]
+        return rows, new_cursor
+
+    def generation(self):
+        # Chỉ append → kích thước file là cursor của dòng cuối cùng
+        return os.path.getsize(self.path)
+
+    def export_csv(self, path):
+        if os.path.abspath(path) == os.path.abspath(self.path):
+            return
+        rows = self.read_all()
+        _write_csv(path, self.columns, rows)
+
+
+class SqliteStore(EvalStore):
+    """SQLite ở chế độ WAL: mỗi lần ghi là 1 INSERT, an toàn với nhiều worker."""
+
+    def __init__(self, path, import_csv=None):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        # Tạo bảng, thêm cột thiếu và nhập CSV cũ trong 1 transaction ghi: nhiều
+        # worker khởi động cùng lúc thì chỉ worker đầu tiên nhập, các worker sau
+        # chờ khoá rồi thấy bảng đã có dữ liệu
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS evaluations (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                + ", ".join(f'"{c}"' for c in EVAL_COLUMNS) + ")"
+            )
+            self.columns = self._table_columns()
+            # DB tạo trước khi schema có thêm cột (vd. model_order)
+            self._add_columns(EVAL_COLUMNS)
+            if import_csv and os.path.exists(import_csv) and self._is_empty():
+                self._import_csv(import_csv)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _table_columns(self):
+        info = self._conn().execute("PRAGMA table_info(evaluations)").fetchall()
+        return [r[1] for r in info if r[1] != "id"]
+
+    def _is_empty(self):
+        return self._conn().execute("SELECT 1 FROM evaluations LIMIT 1").fetchone() is None
+
+    def _add_columns(self, columns):
+        for column in columns:
+            if column not in self.columns:
+                self._conn().execute(f'ALTER TABLE evaluations ADD COLUMN "{column}"')
+                self.columns.append(column)
+
+    def _import_csv(self, csv_path):
+        # Chuyển dữ liệu CSV cũ vào DB, giữ cả các cột lạ (mcq_correct, mcq_type, ...);
+        # gọi trong transaction của __init__
+        with open(csv_path, encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            rows = [{c: _coerce(v, c) for c, v in r.items()} for r in reader]
+            header = [c for c in reader.fieldnames or [] if c]
+        self._add_columns(header)
+        self._conn().executemany(
+            "INSERT INTO evaluations (" + ", ".join(f'"{c}"' for c in header) + ") VALUES ("
+            + ", ".join("?" for _ in header) + ")",
+            [[row.get(c) for c in header] for row in rows],
+        )
+
+    def append(self, row):
+        columns = [c for c in self.columns if c in row]
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO evaluations (" + ", ".join(f'"{c}"' for c in columns) + ") VALUES ("
+                + ", ".join("?" for _ in columns) + ")",
+                [row[c] for c in columns],
+            )
+
+    def read_since(self, cursor=0):
+        cur = self._conn().execute(
+            "SELECT id, " + ", ".join(f'"{c}"' for c in self.columns)
+            + " FROM evaluations WHERE id > ? ORDER BY id",
+            (cursor,),
+        )
+        rows = []
+        for record in cur:
+            cursor = record[0]
+            rows.append(dict(zip(self.columns, record[1:])))
+        return rows, cursor
+
+    def generation(self):
+        return self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM evaluations").fetchone()[0]
+
+    def export_csv(self, path):
+        _write_csv(path, self.columns, self.read_all())
+
+
+def _write_csv(path, columns, rows):
+    # Ghi ra file tạm rồi đổi tên, để analyze.py không bao giờ đọc file dở dang
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator=line_terminator(path, "\n"))
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(["" if row.get(c) is None else row.get(c) for c in columns])
+    os.replace(tmp_path, path)
+
+
+def get_store(csv_path="data/evaluations.csv", backend=None):
+    """Chọn backend theo biến môi trường EVAL_STORE: 'csv' (mặc định) hoặc 'sqlite'."""
+    backend = backend or os.getenv("EVAL_STORE", "csv")
+    if backend == "csv":
+        return CsvAppendStore(csv_path)
+    if backend == "sqlite":
+        db_path = os.getenv("EVAL_DB_PATH", os.path.splitext(csv_path)[0] + ".db")
+        return SqliteStore(db_path, import_csv=csv_path)
+    raise ValueError(f"❌ Unknown EVAL_STORE backend '{backend}'. Available: ['csv', 'sqlite']")
@@ -1,34 +1,63 @@
+import os
+import argparse
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from textstat import flesch_reading_ease
+from shards import read_stories
 
-# Đọc 3 kết quả
-df_mistral = pd.read_csv("outputs/294-doctrines-mistral/294_doctrine_stories.tsv", sep='\t')
-df_llama3  = pd.read_csv("outputs/294-doctrines-llama3/294_doctrine_stories.tsv", sep='\t')
-df_gpt35   = pd.read_csv("outputs/294-doctrines-gpt-3.5/294_doctrine_stories.tsv", sep='\t')
-
-# Gộp thành 1 DataFrame dài
-df_all = pd.concat([
-    df_mistral.assign(model="mistral"),
-    df_llama3.assign(model="llama3"),
-    df_gpt35.assign(model="gpt-3.5"),
-])
-
-def compute_metrics(row):
-    story = str(row['story'])
-    words = story.split()
-    word_count = len(words)
-    ttr = len(set(words)) / len(words) if words else 0
-    flesch = flesch_reading_ease(story) if story else 0
-    return pd.Series({
-        "length": len(story),
+
+def flesch_chunk(stories):
+    return [flesch_reading_ease(story) if story else 0 for story in stories]
+
+
+def compute_metrics(stories, workers=None):
+    """Tính length, word_count, ttr (vector hoá) và flesch_score (chia chunk cho process pool)."""
+    stories = stories.astype(str).tolist()
+    words = [story.split() for story in stories]
+    word_count = np.fromiter((len(w) for w in words), dtype=float, count=len(words))
+    unique_count = np.fromiter((len(set(w)) for w in words), dtype=float, count=len(words))
+    ttr = np.divide(unique_count, word_count, out=np.zeros_like(word_count), where=word_count > 0)
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(stories) > workers:
+        chunk_size = -(-len(stories) // (workers * 4))
+        chunks = [stories[i:i + chunk_size] for i in range(0, len(stories), chunk_size)]
+        with ProcessPoolExecutor(workers) as pool:
+            flesch = [score for chunk in pool.map(flesch_chunk, chunks) for score in chunk]
+    else:
+        flesch = flesch_chunk(stories)
+
+    # Giữ kiểu float64 cho cả 4 cột như bản apply() trước đây
+    return pd.DataFrame({
+        "length": np.fromiter((len(s) for s in stories), dtype=float, count=len(stories)),
         "word_count": word_count,
         "ttr": ttr,
-        "flesch_score": flesch
+        "flesch_score": np.asarray(flesch, dtype=float),
     })
 
-metrics = df_all.apply(compute_metrics, axis=1)
-df_all = pd.concat([df_all, metrics], axis=1)
 
-df_all.to_csv("outputs/story_evaluation.tsv", sep='\t', index=False)
-print("✅ Created outputs/story_evaluation.tsv with all metrics.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Số process tính flesch_score (mặc định = số CPU)")
+    args = parser.parse_args()
+
+    # Đọc 3 kết quả
+    df_mistral = read_stories("mistral")
+    df_llama3  = read_stories("llama3")
+    df_gpt35   = read_stories("gpt-3.5")
+
+    # Gộp thành 1 DataFrame dài
+    df_all = pd.concat([
+        df_mistral.assign(model="mistral"),
+        df_llama3.assign(model="llama3"),
+        df_gpt35.assign(model="gpt-3.5"),
+    ])
+
+    metrics = compute_metrics(df_all["story"], args.workers)
+    metrics.index = df_all.index
+    df_all = pd.concat([df_all, metrics], axis=1)
 
+    df_all.to_csv("outputs/story_evaluation.tsv", sep='\t', index=False)
+    print("✅ Created outputs/story_evaluation.tsv with all metrics.")
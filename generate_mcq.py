@@ -1,22 +1,52 @@
-import pandas as pd
 import os
 from dotenv import load_dotenv
 import httpx
 from tqdm import tqdm
 import json
 import re
+import csv
+import sys
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from checkpoint import load_checkpoint, RunSummary
+from llm_client import chat_completion
+from llm_cache import open_cache
+from llm_telemetry import open_telemetry
+from batching import BatchStats, batch_prompt, chunked, split_batch
+from mcq_dataset import (MCQ_TYPES, UNIT_OK, normalize_question, write_columnar,
+                         PARQUET_PATH, TABLE_PATH, MANIFEST_PATH)
 
 # ==== Load API ====
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
-headers = {"Authorization": f"Bearer {api_key}"}
 
-# Đọc dữ liệu stories đã merge
-df = pd.read_csv("outputs/merged_stories.tsv", sep='\t')
+# ==== Tham số dòng lệnh ====
+parser = argparse.ArgumentParser()
+parser.add_argument("--resume", action="store_true",
+                    help="Chạy tiếp từ merged_mcq.tsv cũ, bỏ qua các (doctrine, model) đã có MCQ hợp lệ")
+parser.add_argument("--no-cache", action="store_true",
+                    help="Luôn gọi API, không dùng cache phản hồi trên đĩa")
+parser.add_argument("--workers", type=int, default=8,
+                    help="Số request sinh MCQ chạy song song")
+parser.add_argument("--batch-size", type=int, default=1,
+                    help="Gộp K story vào 1 request (JSON); story có MCQ thiếu/hỏng được gọi lại riêng")
+parser.add_argument("--verbose", action="store_true",
+                    help="In từng câu hỏi ra stdout (chậm khi chạy số lượng lớn)")
+args = parser.parse_args()
+if args.batch_size < 1:
+    parser.error("--batch-size must be >= 1")
+
+stories_path = "outputs/merged_stories.tsv"
+csv.field_size_limit(sys.maxsize)
 rows = []
+summary = RunSummary()
+cache = open_cache(bypass=args.no_cache)
+telemetry = open_telemetry("mcq")
+batch_stats = BatchStats(args.batch_size)
 
 # ==== Hàm gọi API sinh MCQ ====
-def gen_mcq(story):
+def gen_mcq(story, client=None, tags=None):
     prompt = f"""Given the following legal story:
 
 \"\"\"{story}\"\"\"
@@ -39,9 +69,43 @@ Return the result as a JSON array, with each item having:
             {"role": "user", "content": prompt}
         ]
     }
-    resp = httpx.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=data, timeout=120)
-    resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"]
+    return chat_completion(data, client=client, timeout=120, on_retry=summary.on_retry, cache=cache,
+                           telemetry=telemetry, tags=tags)
+
+# ==== Batch: K story trong 1 request, phản hồi {"items": [{"id", "mcqs"}]} ====
+def valid_mcq_list(mcqs):
+    """Đủ 3 câu hỏi và từng câu hợp lệ theo bảng MCQ (mcq_dataset.normalize_question)."""
+    return (isinstance(mcqs, list) and len(mcqs) == len(MCQ_TYPES)
+            and all(normalize_question(q, i, len(mcqs))["status"] == UNIT_OK for i, q in enumerate(mcqs)))
+
+def gen_mcq_batch(units, client=None):
+    """MCQ (list) cho từng unit theo thứ tự; None = thiếu/không hợp lệ (sẽ gọi lại riêng)."""
+    task = """For EACH legal story below, write 3 multiple-choice questions (with 4 options each, and mark the correct one) to test understanding of:
+1. the legal concept illustrated by the story (type: "concept"),
+2. the expected outcome or ending (type: "ending"),
+3. the limitation or boundary of the legal doctrine (type: "limitation").
+
+Each question has 'type' (one of: "concept", "ending", "limitation"), 'question', 'options' (list of 4 strings) and 'answer' (one of the 4 options)."""
+    items = [(str(i + 1), f'"""{unit["story"]}"""') for i, unit in enumerate(units)]
+    data = {
+        "model": "gpt-3.5-turbo",
+        "messages": [
+            {"role": "system", "content": "You are a legal teaching assistant."},
+            {"role": "user", "content": batch_prompt(
+                task, items, "mcqs", '[{"type": "...", "question": "...", "options": ["..."], "answer": "..."}]')}
+        ]
+    }
+    tags = {"doctrines": [u["doctrine"] for u in units], "story_models": [u["model"] for u in units],
+            "batch_size": len(units)}
+    try:
+        content = chat_completion(data, client=client, timeout=120 * len(units), on_retry=summary.on_retry,
+                                  cache=cache, telemetry=telemetry, tags=tags)
+    except Exception as e:
+        print(f"[⚠️] Batch of {len(units)} failed → {e}; falling back to single requests")
+        return [None] * len(units)
+    mcqs_by_id = split_batch(content, "mcqs")
+    return [mcqs if valid_mcq_list(mcqs) else None
+            for mcqs in (mcqs_by_id.get(str(i + 1)) for i in range(len(units)))]
 
 # ==== Hàm làm sạch phản hồi JSON ====
 def clean_json_content(content):
@@ -62,46 +126,128 @@ model_mapping = {
     "gpt35": "gpt-3.5-turbo"
 }
 
-for _, row in tqdm(df.iterrows(), total=len(df)):
-    for model_key in model_mapping:
-        story = row.get(f"{model_key}_story", "")
-        if pd.isna(story) or not story.strip():
-            continue
-
-        try:
-            mcqs_raw = gen_mcq(story)
-            mcqs_clean = clean_json_content(mcqs_raw)
-        except Exception as e:
-            mcqs_clean = json.dumps({"error": str(e)})
-
-        result_row = {
-            "doctrine": row.get("doctrine", ""),
-            "definition": row.get("definition", ""),
-            "model": model_key,
-            "story": story,
-            "mcqs_json": mcqs_clean
-        }
-        rows.append(result_row)
-
-        # Hiển thị ngay kết quả vừa xử lý
-        print(f"\n✅ Done: {row.get('doctrine', '')} | Model: {model_key}")
-        try:
-            mcqs_parsed = json.loads(mcqs_clean)
-            if isinstance(mcqs_parsed, list) and mcqs_parsed:
-                for mcq in mcqs_parsed:
-                    print(f"  [{mcq.get('type', '?')}] Q: {mcq.get('question', '')}")
-                    print(f"     Options: {mcq.get('options', [])}")
-                    print(f"     Answer: {mcq.get('answer', '')}")
-                    
-            else:
-                print(f"  Error or Empty: {mcqs_parsed}")
-        except Exception as e:
-            print(f"  Failed to parse MCQs: {e}")
-
-# ==== Ghi kết quả ra file ====
+def is_valid_mcqs(row):
+    try:
+        return isinstance(json.loads(row.get("mcqs_json") or ""), list)
+    except Exception:
+        return False
+
+# ==== Checkpoint: ghi từng dòng ngay khi xong, --resume bỏ qua phần đã có ====
 os.makedirs("outputs", exist_ok=True)
 output_path = "outputs/merged_mcq.tsv"
-pd.DataFrame(rows).to_csv(output_path, sep='\t', index=False)
+fieldnames = ["doctrine", "definition", "model", "story", "mcqs_json"]
+done_keys = set()
+if args.resume:
+    done_keys = load_checkpoint(output_path, ["doctrine", "model"], is_complete=is_valid_mcqs, lineterminator="\n")
+
+outfile = open(output_path, 'a' if done_keys else 'w', encoding='utf-8', newline='')
+writer = csv.DictWriter(outfile, fieldnames=fieldnames, delimiter='\t', lineterminator='\n')
+if not done_keys:
+    writer.writeheader()
+
+# ==== Producer: đọc stories theo luồng, mỗi (doctrine, model) là 1 đơn vị ====
+def iter_units(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            for model_key in model_mapping:
+                story = row.get(f"{model_key}_story") or ""
+                if not story.strip():
+                    continue
+                if (row.get("doctrine", ""), model_key) in done_keys:
+                    summary.skipped += 1
+                    continue
+                yield {
+                    "doctrine": row.get("doctrine", ""),
+                    "definition": row.get("definition", ""),
+                    "model": model_key,
+                    "story": story,
+                }
+
+# ==== Worker: gọi API + làm sạch JSON ====
+def process(unit, client):
+    try:
+        tags = {"doctrine": unit["doctrine"], "story_model": unit["model"]}
+        mcqs_clean = clean_json_content(gen_mcq(unit["story"], client=client, tags=tags))
+        # JSON hỏng / không phải list cũng là lỗi (--resume sẽ sinh lại, xem is_valid_mcqs)
+        failed = not is_valid_mcqs({"mcqs_json": mcqs_clean})
+    except Exception as e:
+        mcqs_clean = json.dumps({"error": str(e)})
+        failed = True
+    return {**unit, "mcqs_json": mcqs_clean}, failed
+
+def process_batch(units, client):
+    """1 nhóm unit → list (row, failed); K=1 giữ đúng prompt 1 story / request."""
+    if len(units) == 1:
+        batch_stats.add(1)
+        return [process(units[0], client)]
+    results, fallbacks = [], 0
+    for unit, mcqs in zip(units, gen_mcq_batch(units, client)):
+        if mcqs is None:
+            fallbacks += 1
+            results.append(process(unit, client))
+        else:
+            results.append(({**unit, "mcqs_json": json.dumps(mcqs, ensure_ascii=False)}, False))
+    batch_stats.add(len(units), fallbacks)
+    return results
+
+def print_result(result_row):
+    print(f"\n✅ Done: {result_row['doctrine']} | Model: {result_row['model']}")
+    try:
+        mcqs_parsed = json.loads(result_row["mcqs_json"])
+        if isinstance(mcqs_parsed, list) and mcqs_parsed:
+            for mcq in mcqs_parsed:
+                print(f"  [{mcq.get('type', '?')}] Q: {mcq.get('question', '')}")
+                print(f"     Options: {mcq.get('options', [])}")
+                print(f"     Answer: {mcq.get('answer', '')}")
+        else:
+            print(f"  Error or Empty: {mcqs_parsed}")
+    except Exception as e:
+        print(f"  Failed to parse MCQs: {e}")
+
+# ==== Consumer: ghi theo đúng thứ tự input (chỉ main thread ghi file) ====
+# app.py lấy story / MCQ từ các dòng đầu tiên của mỗi doctrine nên thứ tự dòng
+# phải ổn định giữa các lần chạy; nhóm xong trước được giữ lại tới lượt ghi.
+progress = tqdm(desc="Generating MCQs")
+
+def write_result(future):
+    for result_row, failed in future.result():
+        writer.writerow(result_row)
+        outfile.flush()
+        summary.produced += 1
+        summary.failed += failed
+        progress.update(1)
+        if len(rows) < 3:
+            rows.append(result_row)
+        if args.verbose:
+            print_result(result_row)
+
+# Giới hạn số nhóm chưa ghi (đang chạy + đang chờ tới lượt) để bộ nhớ không tăng theo số story
+max_in_flight = args.workers * 2
+started = time.perf_counter()
+with httpx.Client(timeout=120) as client, ThreadPoolExecutor(args.workers) as pool:
+    pending, seq_of, done = set(), {}, {}
+    next_seq = 0
+
+    def collect(finished):
+        global next_seq
+        for future in finished:
+            done[seq_of.pop(future)] = future
+        while next_seq in done:
+            write_result(done.pop(next_seq))
+            next_seq += 1
+
+    for seq, units in enumerate(chunked(iter_units(stories_path), args.batch_size)):
+        future = pool.submit(process_batch, units, client)
+        seq_of[future] = seq
+        pending.add(future)
+        while seq + 1 - next_seq >= max_in_flight:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    collect(wait(pending).done)
+progress.close()
+elapsed = time.perf_counter() - started
+
+outfile.close()
 
 # ==== In 3 mẫu kết quả ====
 print("\n📋 Sample results:")
@@ -118,4 +264,21 @@ for r in rows[:3]:
     except Exception as e:
         print(f"  Failed to parse JSON: {e}")
 
+summary.report("MCQ generation")
+batch_stats.report(elapsed)
+if cache is not None:
+    cache.report()
+if telemetry is not None:
+    telemetry.report()
 print(f"\n✅ MCQs generated and saved to: {output_path}")
+
+# ==== Bản Parquet + bảng MCQ chuẩn hoá + manifest doctrine cho app.py / analyze_mcq.py ====
+if write_columnar(output_path, PARQUET_PATH, TABLE_PATH, MANIFEST_PATH):
+    print(f"✅ Columnar copy saved to: {PARQUET_PATH}")
+    print(f"✅ MCQ table saved to: {TABLE_PATH}")
+print(f"✅ Doctrine manifest saved to: {MANIFEST_PATH}")
+
+# Mã thoát khác 0 khi còn (doctrine, model) lỗi để pipeline chạy lại stage với --resume
+if summary.failed:
+    print(f"[✗] {summary.failed} unit(s) failed → rerun with --resume")
+    sys.exit(1)
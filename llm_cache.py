@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = ".cache/llm_responses.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def cache_key(url, data):
+    """Hash của (endpoint, model, messages, các tham số khác): cùng request → cùng key."""
+    payload = {
+        "url": url,
+        "model": data.get("model"),
+        "messages": data.get("messages"),
+        "params": {k: v for k, v in data.items() if k not in ("model", "messages")},
+    }
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Cache phản hồi LLM trên đĩa (SQLite), giới hạn dung lượng theo kiểu LRU."""
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, content TEXT, size INTEGER, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self._total = self._total_size()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _total_size(self):
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        with conn:
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, content):
+        size = len(content.encode("utf-8"))
+        conn = self._conn()
+        with conn:
+            # Ghi đè key đã có: chỉ cộng phần chênh lệch kích thước (đọc + ghi trong 1 transaction)
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time()),
+            )
+        with self._lock:
+            self._total += size - (row[0] if row else 0)
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self):
+        # Xoá các mục lâu chưa dùng nhất cho tới khi về dưới 90% giới hạn
+        conn = self._conn()
+        target = int(self.max_bytes * 0.9)
+        with conn:
+            total = self._total_size()
+            cur = conn.execute("SELECT key, size FROM responses ORDER BY last_access")
+            victims = []
+            for key, size in cur:
+                if total <= target:
+                    break
+                victims.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        with self._lock:
+            self._total = total
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        print(f"  Cache: {self.hits} hits / {self.misses} misses ({rate:.1f}% hit rate) → {self.path}")
+
+
+def open_cache(bypass=False):
+    """Cache mặc định cho các script sinh dữ liệu; None nếu bị tắt (--no-cache hoặc LLM_CACHE=off)."""
+    if bypass or os.getenv("LLM_CACHE", "on").lower() in ("0", "off", "false"):
+        return None
+    max_mb = float(os.getenv("LLM_CACHE_MAX_MB", DEFAULT_MAX_BYTES / (1024 * 1024)))
+    return ResponseCache(os.getenv("LLM_CACHE_PATH", DEFAULT_PATH), int(max_mb * 1024 * 1024))
@@ -0,0 +1,372 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import httpx
+
+from llm_cache import cache_key
+
+DEFAULT_BASE = "https://openrouter.ai/api/v1"
+# Lỗi tạm thời: thử lại với exponential backoff
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def chat_url():
+    """URL /chat/completions, lấy từ OPENAI_BASE trong .env (mặc định OpenRouter)."""
+    base = os.getenv("OPENAI_BASE") or DEFAULT_BASE
+    return base.rstrip("/") + "/chat/completions"
+
+
+def auth_headers():
+    return {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+
+
+def backoff_delay(attempt, response=None, base_delay=1.0, max_delay=60.0):
+    """Thời gian chờ trước lần thử thứ attempt+1; tôn trọng Retry-After nếu có."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), max_delay)
+            except ValueError:
+                pass
+    delay = min(base_delay * (2 ** attempt), max_delay)
+    return delay * (0.5 + random.random() / 2)  # jitter
+
+
+def _should_retry(exc):
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUS
+    return isinstance(exc, httpx.TransportError)
+
+
+def _content(body):
+    return body["choices"][0]["message"]["content"]
+
+
+def _attempted(call, resp, exc=None):
+    if call is not None:
+        call.attempt(resp.status_code if resp is not None else type(exc).__name__)
+
+
+def _finish(call, body=None, error=None, cached=False, stream=None):
+    if call is not None:
+        call.finish(body, error, cached, stream)
+
+
+def chat_completion(data, client=None, timeout=60, max_retries=5, on_retry=None, cache=None,
+                    telemetry=None, tags=None):
+    """Gọi /chat/completions (đồng bộ), trả về nội dung message.
+
+    Nếu có `cache` (llm_cache.ResponseCache), request giống hệt lần trước
+    sẽ lấy từ cache mà không gọi API. Nếu có `telemetry` (llm_telemetry.Telemetry),
+    mỗi lần gọi được ghi 1 dòng JSONL (độ trễ, token, số lần thử, mã HTTP, ...)
+    kèm các trường trong `tags`.
+    """
+    call = telemetry.start(data, tags) if telemetry is not None else None
+    key = cache_key(chat_url(), data) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            _finish(call, cached=True)
+            return cached
+    try:
+        body = _chat_completion(data, client, timeout, max_retries, on_retry, call)
+        content = _content(body)
+    except Exception as e:
+        _finish(call, error=e)
+        raise
+    _finish(call, body)
+    if key is not None:
+        cache.put(key, content)
+    return content
+
+
+def _chat_completion(data, client, timeout, max_retries, on_retry, call=None):
+    own_client = client is None
+    client = client or httpx.Client(timeout=timeout)
+    try:
+        for attempt in range(max_retries + 1):
+            resp = None
+            try:
+                resp = client.post(chat_url(), headers=auth_headers(), json=data, timeout=timeout)
+                _attempted(call, resp)
+                resp.raise_for_status()
+                return resp.json()
+            except httpx.HTTPError as e:
+                if resp is None:
+                    _attempted(call, None, e)
+                if attempt == max_retries or not _should_retry(e):
+                    raise
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                time.sleep(backoff_delay(attempt, resp))
+    finally:
+        if own_client:
+            client.close()
+
+
+async def achat_completion(client, data, timeout=60, max_retries=5, on_retry=None, cache=None,
+                           telemetry=None, tags=None):
+    """Như chat_completion nhưng dùng httpx.AsyncClient dùng chung (connection pool)."""
+    call = telemetry.start(data, tags) if telemetry is not None else None
+    key = cache_key(chat_url(), data) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            _finish(call, cached=True)
+            return cached
+    try:
+        body = await _achat_completion(client, data, timeout, max_retries, on_retry, call)
+        content = _content(body)
+    except Exception as e:
+        _finish(call, error=e)
+        raise
+    _finish(call, body)
+    if key is not None:
+        cache.put(key, content)
+    return content
+
+
+async def _achat_completion(client, data, timeout, max_retries, on_retry, call=None):
+    for attempt in range(max_retries + 1):
+        resp = None
+        try:
+            resp = await client.post(chat_url(), headers=auth_headers(), json=data, timeout=timeout)
+            _attempted(call, resp)
+            resp.raise_for_status()
+            return resp.json()
+        except httpx.HTTPError as e:
+            if resp is None:
+                _attempted(call, None, e)
+            if attempt == max_retries or not _should_retry(e):
+                raise
+            if on_retry is not None:
+                on_retry(attempt, e)
+            await asyncio.sleep(backoff_delay(attempt, resp))
+
+
+def async_client(concurrency, timeout=60):
+    """AsyncClient với pool đủ lớn cho `concurrency` request cùng lúc."""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    return httpx.AsyncClient(timeout=timeout, limits=limits)
+
+
+# ==== Chế độ stream (SSE): đo time-to-first-token, cắt sớm khi vượt ngưỡng ====
+class StreamState:
+    """Gom các chunk SSE của 1 lần gửi request: text, TTFT, lý do dừng.
+
+    max_words / max_tokens: đủ ngưỡng thì ngừng đọc và đóng kết nối (model
+    "chạy quá đà" không tốn thêm token); số token = số delta nếu server
+    không gửi usage.
+    """
+
+    def __init__(self, max_words=None, max_tokens=None):
+        self.max_words = max_words
+        self.max_tokens = max_tokens
+        self.started = time.perf_counter()
+        self.parts = []
+        self.deltas = 0
+        # Đếm từ dần theo từng delta (không ghép / tách lại cả text mỗi chunk)
+        self.words = 0
+        self._in_word = False
+        self.ttft = None
+        self.finish_reason = None
+        self.usage = None
+        self.id = None
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    @property
+    def cutoff(self):
+        return self.finish_reason in ("cutoff_words", "cutoff_tokens")
+
+    def _count_words(self, delta):
+        """Cập nhật self.words = len(text.split()) chỉ từ delta mới."""
+        tokens = delta.split()
+        if tokens:
+            # Delta nối tiếp 1 từ đang dở (không có khoảng trắng ở giữa) thì không tính thêm từ đầu
+            joined = self._in_word and not delta[0].isspace()
+            self.words += len(tokens) - (1 if joined else 0)
+        self._in_word = not delta[-1].isspace()
+
+    def feed(self, line):
+        """Xử lý 1 dòng SSE; True = dừng đọc ([DONE] hoặc chạm ngưỡng)."""
+        if not line.startswith("data:"):
+            return False  # dòng trống, comment ": OPENROUTER PROCESSING", event:
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            return True
+        chunk = json.loads(payload)
+        if chunk.get("error"):
+            raise ValueError(f"Stream error: {chunk['error']}")
+        self.id = chunk.get("id") or self.id
+        self.usage = chunk.get("usage") or self.usage
+        for choice in chunk.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                if self.ttft is None:
+                    self.ttft = time.perf_counter() - self.started
+                self.parts.append(delta)
+                self.deltas += 1
+                self._count_words(delta)
+            self.finish_reason = choice.get("finish_reason") or self.finish_reason
+        if self.max_words and self.words >= self.max_words:
+            self.finish_reason = "cutoff_words"
+            return True
+        if self.max_tokens and self.deltas >= self.max_tokens:
+            self.finish_reason = "cutoff_tokens"
+            return True
+        return False
+
+    def body(self):
+        """Dạng giống phản hồi không stream (cho _content và telemetry)."""
+        usage = self.usage if self.usage and not self.cutoff else {"completion_tokens": self.deltas}
+        return {"id": self.id, "usage": usage,
+                "choices": [{"finish_reason": self.finish_reason, "message": {"content": self.text}}]}
+
+    def info(self):
+        return {"ttft_s": None if self.ttft is None else round(self.ttft, 4),
+                "finish_reason": self.finish_reason, "cutoff": self.cutoff}
+
+
+class StreamCutoff(ValueError):
+    """Phản hồi stream chạm max_words / max_tokens: coi là lỗi (không ghi, không cache);
+    phần đã nhận nằm ở partial_text."""
+
+    def __init__(self, state):
+        super().__init__(f"Stream cut off ({state.finish_reason}) after {state.words} words")
+        self.state = state
+        self.partial_text = state.text
+
+
+def _stream_data(data):
+    return {**data, "stream": True, "stream_options": {"include_usage": True}}
+
+
+def _stream_failed(call, e):
+    """Lỗi giữa chừng / bị cắt: phần text đã nhận nằm ở e.partial_text (và trong telemetry) để debug."""
+    partial = getattr(e, "partial_text", "")
+    state = getattr(e, "state", None)
+    stream = {"partial_text": partial[:2000], "partial_words": len(partial.split())}
+    if state is not None:
+        stream.update(state.info())
+    _finish(call, body=None if state is None else state.body(), error=e, stream=stream)
+
+
+def stream_chat_completion(data, client=None, timeout=60, max_retries=5, on_retry=None, cache=None,
+                           telemetry=None, tags=None, max_words=None, max_tokens=None):
+    """Như chat_completion nhưng nhận phản hồi dạng stream (SSE).
+
+    Telemetry ghi thêm ttft_s, finish_reason và cutoff; chạm max_words /
+    max_tokens thì ngừng đọc và raise StreamCutoff (không cache). Mọi lỗi
+    (kể cả sau khi hết lượt thử lại) mang phần text đã nhận ở partial_text;
+    chỉ phản hồi đầy đủ mới được cache nên cache dùng chung với chế độ thường.
+    """
+    call = telemetry.start(data, tags) if telemetry is not None else None
+    key = cache_key(chat_url(), data) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            _finish(call, cached=True)
+            return cached
+    try:
+        state = _stream_completion(data, client, timeout, max_retries, on_retry, call, max_words, max_tokens)
+        if state.cutoff:
+            raise StreamCutoff(state)
+    except Exception as e:
+        _stream_failed(call, e)
+        raise
+    _finish(call, state.body(), stream=state.info())
+    content = state.text
+    if key is not None:
+        cache.put(key, content)
+    return content
+
+
+def _stream_completion(data, client, timeout, max_retries, on_retry, call, max_words, max_tokens):
+    own_client = client is None
+    client = client or httpx.Client(timeout=timeout)
+    try:
+        for attempt in range(max_retries + 1):
+            resp = None
+            state = StreamState(max_words, max_tokens)
+            try:
+                with client.stream("POST", chat_url(), headers=auth_headers(), json=_stream_data(data),
+                                   timeout=timeout) as resp:
+                    _attempted(call, resp)
+                    resp.raise_for_status()
+                    for line in resp.iter_lines():
+                        if state.feed(line):
+                            break  # thoát khối with → đóng kết nối, server ngừng sinh
+                return state
+            except httpx.HTTPError as e:
+                e.partial_text = state.text
+                if resp is None:
+                    _attempted(call, None, e)
+                if attempt == max_retries or not _should_retry(e):
+                    raise
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                time.sleep(backoff_delay(attempt, resp))
+            except ValueError as e:
+                e.partial_text = state.text
+                raise
+    finally:
+        if own_client:
+            client.close()
+
+
+async def astream_chat_completion(client, data, timeout=60, max_retries=5, on_retry=None, cache=None,
+                                  telemetry=None, tags=None, max_words=None, max_tokens=None):
+    """Như stream_chat_completion nhưng dùng httpx.AsyncClient dùng chung."""
+    call = telemetry.start(data, tags) if telemetry is not None else None
+    key = cache_key(chat_url(), data) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            _finish(call, cached=True)
+            return cached
+    try:
+        state = await _astream_completion(client, data, timeout, max_retries, on_retry, call, max_words, max_tokens)
+        if state.cutoff:
+            raise StreamCutoff(state)
+    except Exception as e:
+        _stream_failed(call, e)
+        raise
+    _finish(call, state.body(), stream=state.info())
+    content = state.text
+    if key is not None:
+        cache.put(key, content)
+    return content
+
+
+async def _astream_completion(client, data, timeout, max_retries, on_retry, call, max_words, max_tokens):
+    for attempt in range(max_retries + 1):
+        resp = None
+        state = StreamState(max_words, max_tokens)
+        try:
+            async with client.stream("POST", chat_url(), headers=auth_headers(), json=_stream_data(data),
+                                     timeout=timeout) as resp:
+                _attempted(call, resp)
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if state.feed(line):
+                        break
+            return state
+        except httpx.HTTPError as e:
+            e.partial_text = state.text
+            if resp is None:
+                _attempted(call, None, e)
+            if attempt == max_retries or not _should_retry(e):
+                raise
+            if on_retry is not None:
+                on_retry(attempt, e)
+            await asyncio.sleep(backoff_delay(attempt, resp))
+        except ValueError as e:
+            e.partial_text = state.text
+            raise
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+
+DEFAULT_PATH = "logs/llm_calls.jsonl"
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def error_kind(exc):
+    """Nhóm lỗi cho bảng thống kê: http_429, http_5xx, timeout, transport, bad_response, ..."""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None) if response is not None else None
+    if status is not None:
+        return f"http_{status}"
+    name = type(exc).__name__
+    if name == "StreamCutoff":
+        return "cutoff"
+    if "Timeout" in name:
+        return "timeout"
+    if isinstance(exc, (KeyError, IndexError, ValueError)):
+        return "bad_response"
+    return "transport" if "Error" in name and type(exc).__module__.startswith("httpx") else name
+
+
+class CallRecord:
+    """Theo dõi 1 lần gọi chat_completion (gồm cả các lần thử lại)."""
+
+    def __init__(self, telemetry, data, tags):
+        self.telemetry = telemetry
+        self.model = data.get("model")
+        self.tags = tags or {}
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.statuses = []
+
+    def attempt(self, status):
+        """Ghi mã HTTP (hoặc tên lỗi mạng) của từng lần gửi request."""
+        self.statuses.append(status)
+
+    def finish(self, body=None, error=None, cached=False, stream=None):
+        """stream (chế độ SSE): ttft_s, finish_reason, cutoff; hoặc partial_text khi lỗi."""
+        usage = (body or {}).get("usage") or {}
+        record = {
+            "ts": self.started_at,
+            "stage": self.telemetry.stage,
+            "model": self.model,
+            **self.tags,
+            "ok": error is None,
+            "cached": cached,
+            "latency_s": round(time.perf_counter() - self._started, 4),
+            "attempts": len(self.statuses),
+            "retries": max(0, len(self.statuses) - 1),
+            "status": self.statuses[-1] if self.statuses else None,
+            "statuses": self.statuses,
+            "error": None if error is None else error_kind(error),
+            "error_message": None if error is None else str(error)[:500],
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "total_tokens": usage.get("total_tokens"),
+            # OpenRouter trả usage.cost (USD) khi bật usage accounting
+            "cost": usage.get("cost"),
+            "response_id": (body or {}).get("id"),
+        }
+        if stream is not None:
+            record.update({"streamed": True, **stream})
+        self.telemetry.write(record)
+        return record
+
+
+class Telemetry:
+    """Ghi 1 dòng JSONL cho mỗi lần gọi API và tổng hợp theo model cuối lần chạy."""
+
+    def __init__(self, stage, path=DEFAULT_PATH):
+        self.stage = stage
+        self.path = path
+        self._lock = threading.Lock()
+        self.records = []
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def start(self, data, tags=None):
+        return CallRecord(self, data, tags)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.records.append(record)
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def summary(self):
+        """Thống kê theo model: throughput, phân vị độ trễ, tokens/s, phân loại lỗi."""
+        with self._lock:
+            records = list(self.records)
+        by_model = {}
+        for r in records:
+            by_model.setdefault(r["model"] or "?", []).append(r)
+
+        result = {}
+        for model, rows in sorted(by_model.items()):
+            live = [r for r in rows if not r["cached"]]
+            latencies = sorted(r["latency_s"] for r in live)
+            span = (max(r["ts"] + r["latency_s"] for r in rows) - min(r["ts"] for r in rows)) if rows else 0
+            completion = sum(r["completion_tokens"] or 0 for r in live)
+            failures = {}
+            for r in rows:
+                if not r["ok"]:
+                    failures[r["error"]] = failures.get(r["error"], 0) + 1
+            costs = [r["cost"] for r in live if r["cost"] is not None]
+            ttfts = sorted(r["ttft_s"] for r in live if r.get("ttft_s") is not None)
+            result[model] = {
+                "calls": len(rows),
+                "ok": sum(r["ok"] for r in rows),
+                "failed": len(rows) - sum(r["ok"] for r in rows),
+                "cached": len(rows) - len(live),
+                "retries": sum(r["retries"] for r in rows),
+                "calls_per_second": len(rows) / span if span > 0 else None,
+                "latency_p50": percentile(latencies, 50),
+                "latency_p90": percentile(latencies, 90),
+                "latency_p99": percentile(latencies, 99),
+                "prompt_tokens": sum(r["prompt_tokens"] or 0 for r in live),
+                "completion_tokens": completion,
+                "completion_tokens_per_second": completion / span if span > 0 else None,
+                "cost": sum(costs) if costs else None,
+                "ttft_p50": percentile(ttfts, 50),
+                "ttft_p90": percentile(ttfts, 90),
+                "cutoffs": sum(1 for r in rows if r.get("cutoff")),
+                "failures": failures,
+            }
+        return result
+
+    def report(self):
+        summary = self.summary()
+        print(f"\n📈 API calls ({self.stage}) → {self.path}")
+        for model, s in summary.items():
+            rate = f"{s['calls_per_second']:.2f}/s" if s["calls_per_second"] else "-"
+            tok_rate = f"{s['completion_tokens_per_second']:.1f} tok/s" if s["completion_tokens_per_second"] else "- tok/s"
+            p50, p90, p99 = (f"{v:.2f}s" if v is not None else "-"
+                             for v in (s["latency_p50"], s["latency_p90"], s["latency_p99"]))
+            print(f"  {model}: {s['calls']} calls ({s['ok']} ok, {s['failed']} failed, {s['cached']} cached,"
+                  f" {s['retries']} retries) | {rate} | p50 {p50} p90 {p90} p99 {p99} | {tok_rate}"
+                  + (f" | ${s['cost']:.4f}" if s["cost"] is not None else ""))
+            if s["ttft_p50"] is not None:
+                print(f"    TTFT p50 {s['ttft_p50']:.2f}s p90 {s['ttft_p90']:.2f}s | {s['cutoffs']} cut off at the ceiling")
+            if s["failures"]:
+                print(f"    failures: {s['failures']}")
+        return summary
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def open_telemetry(stage):
+    """Telemetry mặc định cho các script sinh dữ liệu; None nếu LLM_TELEMETRY=off."""
+    path = os.getenv("LLM_TELEMETRY", DEFAULT_PATH)
+    if path.lower() in ("0", "off", "false"):
+        return None
+    return Telemetry(stage, path)
@@ -1,10 +1,25 @@
 import os
 import csv
+import asyncio
 from dotenv import load_dotenv
 from model import get_model_name
 from tqdm import tqdm
 import argparse
+import sys
+import time
 import httpx
+from llm_client import (chat_completion, achat_completion, async_client,
+                        stream_chat_completion, astream_chat_completion)
+from checkpoint import line_terminator, load_checkpoint, RunSummary
+from llm_cache import open_cache
+from llm_telemetry import open_telemetry
+from batching import BatchStats, batch_prompt, chunked, split_batch
+from shards import parse_shard, shard_of, shard_path, story_dir, STORY_FILE
+
+try:
+    import fcntl
+except ImportError:  # Windows: không hỗ trợ --claim
+    fcntl = None
 
 # ==== Load API key từ .env ====
 load_dotenv()
@@ -14,17 +29,50 @@ if not api_key:
 # ==== Tham số dòng lệnh ====
 parser = argparse.ArgumentParser()
 parser.add_argument("--model", type=str, required=True)
+parser.add_argument("--async", dest="use_async", action="store_true",
+                    help="Gửi nhiều request song song bằng httpx.AsyncClient")
+parser.add_argument("--concurrency", type=int, default=8,
+                    help="Số request tối đa cùng lúc ở chế độ --async")
+parser.add_argument("--max-retries", type=int, default=5,
+                    help="Số lần thử lại khi gặp 429/5xx hoặc lỗi mạng")
+parser.add_argument("--batch-size", type=int, default=1,
+                    help="Gộp K doctrine vào 1 request (JSON); story thiếu/hỏng được sinh lại riêng từng doctrine")
+parser.add_argument("--stream", action="store_true",
+                    help="Nhận phản hồi dạng stream (SSE): ghi time-to-first-token, cắt sớm theo --max-words/--max-tokens")
+parser.add_argument("--max-words", type=int, default=600,
+                    help="--stream: ngừng sinh khi story đạt số từ này (mục tiêu 150-300 từ); "
+                         "story bị cắt tính là lỗi, không ghi / không cache")
+parser.add_argument("--max-tokens", type=int, default=None,
+                    help="--stream: ngừng sinh khi nhận đủ số token (chunk) này (bị cắt = lỗi như trên)")
+parser.add_argument("--resume", action="store_true",
+                    help="Chạy tiếp từ file output cũ, bỏ qua các doctrine đã có story")
+parser.add_argument("--no-cache", action="store_true",
+                    help="Luôn gọi API, không dùng cache phản hồi trên đĩa")
+shard_group = parser.add_mutually_exclusive_group()
+shard_group.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                         help="Chỉ sinh các doctrine thuộc shard i trong N (chia theo hash), ghi ra file shard riêng")
+shard_group.add_argument("--claim", type=int, default=None, metavar="N",
+                         help="Chia N shard và lần lượt nhận các shard chưa xong (khoá file), "
+                              "chạy nhiều process / máy cùng lúc trên cùng thư mục outputs")
+parser.add_argument("--claim-poll", type=float, default=10.0,
+                    help="--claim: số giây chờ trước khi xem lại các shard đang bị worker khác giữ")
 args = parser.parse_args()
+if args.batch_size < 1:
+    parser.error("--batch-size must be >= 1")
 model_name = get_model_name(args.model)
 
 # ==== Đường dẫn ====
 input_path = "data/legal_doctrines_294.csv"
-output_dir = f"outputs/294-doctrines-{args.model}"
+output_dir = story_dir(args.model)
 os.makedirs(output_dir, exist_ok=True)
-output_file = os.path.join(output_dir, "294_doctrine_stories.tsv")
+output_file = os.path.join(output_dir, STORY_FILE)
+summary = RunSummary()
+cache = open_cache(bypass=args.no_cache)
+telemetry = open_telemetry(f"story-{args.model}")
+batch_stats = BatchStats(args.batch_size)
 
 # ==== Hàm sinh truyện từ định nghĩa ====
-def gen_story(definition, doctrine):
+def story_request(definition, doctrine):
     prompt = f"""
 You are a legal storytelling assistant. Your task is to create a short, fictional but realistic story that illustrates the legal concept of '{doctrine}'.
 
@@ -32,28 +80,242 @@ Definition: {definition}
 
 Write a story (around 150-300 words) that helps a non-expert understand this legal concept through a relatable scenario.
 """
-    headers = {"Authorization": f"Bearer {api_key}"}
-    data = {
+    return {
         "model": model_name,
         "messages": [
             {"role": "system", "content": "You are a helpful legal storytelling assistant."},
             {"role": "user", "content": prompt}
         ]
     }
-    resp = httpx.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=data, timeout=60)
-    resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"].strip()
+
+def complete(data, client, timeout, tags, n_items=1):
+    """Gọi API (stream nếu --stream; ngưỡng từ/token nhân theo số item trong batch)."""
+    kwargs = dict(client=client, timeout=timeout, max_retries=args.max_retries, on_retry=summary.on_retry,
+                  cache=cache, telemetry=telemetry, tags=tags)
+    if not args.stream:
+        return chat_completion(data, **kwargs)
+    return stream_chat_completion(data, max_words=args.max_words and args.max_words * n_items,
+                                  max_tokens=args.max_tokens and args.max_tokens * n_items, **kwargs)
+
+async def acomplete(client, data, timeout, tags, n_items=1):
+    kwargs = dict(timeout=timeout, max_retries=args.max_retries, on_retry=summary.on_retry,
+                  cache=cache, telemetry=telemetry, tags=tags)
+    if not args.stream:
+        return await achat_completion(client, data, **kwargs)
+    return await astream_chat_completion(client, data, max_words=args.max_words and args.max_words * n_items,
+                                         max_tokens=args.max_tokens and args.max_tokens * n_items, **kwargs)
+
+def gen_story(definition, doctrine, client=None):
+    data = story_request(definition, doctrine)
+    content = complete(data, client, 60, {"doctrine": doctrine})
+    return content.strip()
+
+async def agen_story(client, definition, doctrine):
+    data = story_request(definition, doctrine)
+    content = await acomplete(client, data, 60, {"doctrine": doctrine})
+    return content.strip()
+
+# ==== Batch: K doctrine trong 1 request, phản hồi {"items": [{"id", "story"}]} ====
+MIN_STORY_WORDS = 50  # ngắn hơn thì coi như bị cắt / hỏng → sinh lại riêng
+
+def story_batch_request(rows):
+    task = """
+You are a legal storytelling assistant. For EACH legal concept below, create a short, fictional but realistic story that illustrates it.
+
+Each story should be around 150-300 words and help a non-expert understand the concept through a relatable scenario.
+"""
+    items = [(str(i + 1), f"Doctrine: {row['doctrine']}\nDefinition: {row['definition']}") for i, row in enumerate(rows)]
+    return {
+        "model": model_name,
+        "messages": [
+            {"role": "system", "content": "You are a helpful legal storytelling assistant."},
+            {"role": "user", "content": batch_prompt(task, items, "story", '"<story text>"')}
+        ]
+    }
+
+def split_stories(rows, content):
+    """Story theo thứ tự rows; None = thiếu hoặc không hợp lệ (sẽ fallback)."""
+    stories = split_batch(content, "story")
+    result = []
+    for i in range(len(rows)):
+        story = stories.get(str(i + 1))
+        ok = isinstance(story, str) and len(story.split()) >= MIN_STORY_WORDS
+        result.append(story.strip() if ok else None)
+    return result
+
+def batch_tags(rows):
+    return {"doctrines": [row["doctrine"] for row in rows], "batch_size": len(rows)}
+
+def gen_stories(rows, client=None):
+    try:
+        content = complete(story_batch_request(rows), client, 60 * len(rows), batch_tags(rows), len(rows))
+        return split_stories(rows, content)
+    except Exception as e:
+        print(f"[⚠️] Batch of {len(rows)} failed → {e}; falling back to single requests")
+        return [None] * len(rows)
+
+async def agen_stories(client, rows):
+    try:
+        content = await acomplete(client, story_batch_request(rows), 60 * len(rows), batch_tags(rows), len(rows))
+        return split_stories(rows, content)
+    except Exception as e:
+        print(f"[⚠️] Batch of {len(rows)} failed → {e}; falling back to single requests")
+        return [None] * len(rows)
+
+def fail(row, e):
+    summary.failed += 1
+    print(f"[⚠️] Failed on {row['doctrine']} → {e}")
+    partial = getattr(e, "partial_text", "")
+    if partial:  # --stream: phần đã nhận trước khi lỗi (đầy đủ trong telemetry JSONL)
+        print(f"    partial ({len(partial.split())} words): {partial[:200]!r}")
+
+# ==== Chế độ tuần tự (mặc định) ====
+def run_sync(rows, write_row):
+    progress = tqdm(total=len(rows), desc=f"Generating stories with {args.model}")
+    with httpx.Client(timeout=60) as client:
+        for chunk in chunked(rows, args.batch_size):
+            stories = gen_stories(chunk, client=client) if len(chunk) > 1 else [None]
+            batch_stats.add(len(chunk), stories.count(None) if len(chunk) > 1 else 0)
+            for row, story in zip(chunk, stories):
+                try:
+                    if story is None:
+                        story = gen_story(row["definition"], row["doctrine"], client=client)
+                    write_row([row["doctrine"], row["definition"], story])
+                except Exception as e:
+                    fail(row, e)
+                progress.update(1)
+    progress.close()
+
+# ==== Chế độ async: tối đa `concurrency` request cùng lúc, ghi theo đúng thứ tự doctrine ====
+async def run_async(rows, write_row, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    done = {}
+    next_idx = 0
+    progress = tqdm(total=len(rows), desc=f"Generating stories with {args.model} (async x{concurrency})")
+
+    async def worker(client, start, chunk):
+        nonlocal next_idx
+        async with semaphore:
+            stories = await agen_stories(client, chunk) if len(chunk) > 1 else [None]
+            batch_stats.add(len(chunk), stories.count(None) if len(chunk) > 1 else 0)
+            for idx, row, story in zip(range(start, start + len(chunk)), chunk, stories):
+                try:
+                    if story is None:
+                        story = await agen_story(client, row["definition"], row["doctrine"])
+                    done[idx] = [row["doctrine"], row["definition"], story]
+                except Exception as e:
+                    fail(row, e)
+                    done[idx] = None
+                progress.update(1)
+        # Ghi phần đầu liên tục đã xong để file giữ thứ tự như input
+        while next_idx in done:
+            result = done.pop(next_idx)
+            if result is not None:
+                write_row(result)
+            next_idx += 1
+
+    async with async_client(concurrency) as client:
+        chunks = chunked(rows, args.batch_size)
+        await asyncio.gather(*(worker(client, i * args.batch_size, chunk) for i, chunk in enumerate(chunks)))
+    progress.close()
 
 # ==== Đọc dữ liệu và ghi kết quả ====
-with open(input_path, newline='', encoding='utf-8') as infile, \
-     open(output_file, 'w', encoding='utf-8', newline='') as outfile:
-    reader = csv.DictReader(infile)
-    writer = csv.writer(outfile, delimiter='\t')
-    writer.writerow(["doctrine", "definition", "story"])
-
-    for row in tqdm(reader, desc=f"Generating stories with {args.model}"):
-        try:
-            story = gen_story(row["definition"], row["doctrine"])
-            writer.writerow([row["doctrine"], row["definition"], story])
-        except Exception as e:
-            print(f"[⚠️] Failed on {row['doctrine']} → {e}")
+def generate(output_file, resume, shard=None):
+    """Sinh story cho các doctrine (chỉ shard (i, N) nếu có) vào output_file.
+
+    resume: giữ các story đã sinh (dòng lỗi/dở dang bị bỏ) và chỉ sinh phần còn thiếu.
+    Trả về số doctrine bị lỗi.
+    """
+    done_keys = set()
+    if resume:
+        done_keys = load_checkpoint(output_file, ["doctrine"], is_complete=lambda r: bool((r.get("story") or "").strip()))
+    failed_before = summary.failed
+
+    with open(input_path, newline='', encoding='utf-8') as infile, \
+         open(output_file, 'a' if done_keys else 'w', encoding='utf-8', newline='') as outfile:
+        reader = csv.DictReader(infile)
+        # Ghi nối thì giữ kiểu xuống dòng của file cũ (file trong repo dùng \n)
+        writer = csv.writer(outfile, delimiter='\t',
+                            lineterminator=line_terminator(output_file) if done_keys else '\r\n')
+        if not done_keys:
+            writer.writerow(["doctrine", "definition", "story"])
+
+        rows = []
+        for row in reader:
+            if shard is not None and shard_of(row["doctrine"], shard[1]) != shard[0]:
+                continue
+            if (row["doctrine"],) in done_keys:
+                summary.skipped += 1
+            else:
+                rows.append(row)
+
+        def write_row(values):
+            # Flush từng dòng để Ctrl-C / crash không mất những gì đã xong
+            writer.writerow(values)
+            outfile.flush()
+            summary.produced += 1
+
+        if args.use_async:
+            asyncio.run(run_async(rows, write_row, args.concurrency))
+        else:
+            run_sync(rows, write_row)
+    return summary.failed - failed_before
+
+
+def run_claimed(count):
+    """Nhận lần lượt các shard chưa xong; shard đang bị worker khác khoá thì bỏ qua.
+
+    Shard chạy xong không lỗi được đánh dấu bằng file .done. Worker chết giữa
+    chừng thì khoá tự nhả, worker khác (đang chờ) nhận lại và chạy tiếp từ file
+    shard dở dang. Mỗi process chỉ thử 1 shard 1 lần để không lặp mãi khi lỗi.
+    """
+    if fcntl is None:
+        raise RuntimeError("❌ --claim needs fcntl (file locks); use --shard i/N instead.")
+    attempted = set()
+    while True:
+        busy = 0
+        for index in range(count):
+            path = shard_path(args.model, index, count)
+            if index in attempted or os.path.exists(path + ".done"):
+                continue
+            with open(path + ".lock", "a") as lock:
+                try:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    busy += 1
+                    continue
+                if os.path.exists(path + ".done"):  # vừa xong bởi worker khác
+                    continue
+                attempted.add(index)
+                print(f"[🔒] Claimed shard {index}/{count} → {path}")
+                if generate(path, resume=True, shard=(index, count)) == 0:
+                    with open(path + ".done", "w") as f:
+                        f.write(f"{time.time()}\n")
+                else:
+                    print(f"[⚠️] Shard {index}/{count} has failures; left unfinished for a later run")
+        if busy == 0:
+            break
+        print(f"[⏳] {busy} shard(s) held by other workers; checking again in {args.claim_poll}s")
+        time.sleep(args.claim_poll)
+
+
+started = time.perf_counter()
+if args.claim is not None:
+    run_claimed(args.claim)
+elif args.shard is not None:
+    generate(shard_path(args.model, *args.shard), args.resume, args.shard)
+else:
+    generate(output_file, args.resume)
+
+summary.report(f"Stories with {args.model}")
+batch_stats.report(time.perf_counter() - started)
+if cache is not None:
+    cache.report()
+if telemetry is not None:
+    telemetry.report()
+
+# Mã thoát khác 0 khi còn doctrine lỗi: pipeline không đánh dấu stage là xong
+# (lần chạy sau sẽ chạy lại với --resume thay vì bỏ qua vì đầu vào không đổi)
+if summary.failed:
+    print(f"[✗] {summary.failed} doctrine(s) failed → rerun with --resume")
+    sys.exit(1)
@@ -0,0 +1,189 @@
+import json
+import os
+
+# pandas được import trong từng hàm: app.py import module này khi khởi động
+# nhưng chỉ cần pandas khi thực sự nạp dữ liệu
+
+TSV_PATH = "outputs/merged_mcq.tsv"
+PARQUET_PATH = "outputs/merged_mcq.parquet"
+TABLE_PATH = "outputs/mcq_table.parquet"
+MANIFEST_PATH = "outputs/doctrine_manifest.json"
+MCQ_TYPES = ("concept", "ending", "limitation")
+
+# Trạng thái của cả 1 dòng mcqs_json (doctrine, model)
+UNIT_OK = "ok"
+UNIT_ERRORS = ("api_error", "invalid_json", "not_a_list", "empty")
+# Trạng thái của từng câu hỏi
+QUESTION_ERRORS = ("not_an_object", "unknown_type", "missing_question", "bad_options", "answer_not_in_options")
+
+TABLE_COLUMNS = [
+    "doctrine", "model", "unit", "position", "type", "type_source",
+    "question", "options", "n_options", "answer", "status", "unit_status",
+]
+
+
+# ==== Phân loại lỗi ====
+def classify_unit(mcqs_json):
+    """Trả về (unit_status, danh sách câu hỏi)."""
+    try:
+        mcqs = json.loads(mcqs_json)
+    except Exception:
+        return "invalid_json", []
+    if isinstance(mcqs, dict):
+        # clean_json_content ghi {"error", "raw"} khi model trả JSON hỏng,
+        # generate_mcq ghi {"error"} khi request API thất bại
+        return ("invalid_json" if "raw" in mcqs else "api_error"), []
+    if not isinstance(mcqs, list):
+        return "not_a_list", []
+    if not mcqs:
+        return "empty", []
+    return UNIT_OK, mcqs
+
+
+def normalize_question(q, position, n_questions):
+    """Chuẩn hoá 1 câu hỏi thành dict các cột của bảng, kèm status."""
+    row = {"position": position, "type": None, "type_source": None, "question": None,
+           "options": None, "n_options": 0, "answer": None, "status": UNIT_OK}
+    if not isinstance(q, dict):
+        row["status"] = "not_an_object"
+        return row
+
+    qtype = str(q.get("type") or "").strip().lower()
+    if qtype:
+        row["type"], row["type_source"] = qtype, "model"
+    elif n_questions == len(MCQ_TYPES):
+        # Prompt yêu cầu đúng thứ tự concept, ending, limitation
+        row["type"], row["type_source"] = MCQ_TYPES[position], "position"
+
+    options = q.get("options")
+    if isinstance(options, list):
+        row["options"] = [str(o) for o in options]
+        row["n_options"] = len(options)
+    question, answer = q.get("question"), q.get("answer")
+    row["question"] = None if question is None else str(question)
+    row["answer"] = None if answer is None else str(answer)
+
+    if row["type"] not in MCQ_TYPES:
+        row["status"] = "unknown_type"
+    elif not row["question"]:
+        row["status"] = "missing_question"
+    elif row["options"] is None or len(row["options"]) < 2:
+        row["status"] = "bad_options"
+    elif row["answer"] not in row["options"]:
+        row["status"] = "answer_not_in_options"
+    return row
+
+
+# ==== Dựng bảng MCQ chuẩn hoá (1 dòng / câu hỏi) ====
+def build_mcq_table(df):
+    """Tách mcqs_json thành bảng (doctrine, model, type, question, options, answer, status).
+
+    Mỗi dòng TSV (unit) lỗi ở mức JSON có đúng 1 dòng với position = -1.
+    """
+    import pandas as pd
+    records = []
+    for unit, (doctrine, model, mcqs_json) in enumerate(zip(df["doctrine"], df["model"], df["mcqs_json"])):
+        unit_status, mcqs = classify_unit(mcqs_json)
+        base = {"doctrine": doctrine, "model": model, "unit": unit, "unit_status": unit_status}
+        if unit_status != UNIT_OK:
+            records.append({**base, "position": -1, "type": None, "type_source": None, "question": None,
+                            "options": None, "n_options": 0, "answer": None, "status": unit_status})
+            continue
+        for position, q in enumerate(mcqs):
+            records.append({**base, **normalize_question(q, position, len(mcqs))})
+    return pd.DataFrame.from_records(records, columns=TABLE_COLUMNS)
+
+
+def build_columnar(df):
+    """Dữ liệu story dạng cột (bỏ mcqs_json thô; MCQ nằm ở bảng mcq_table)."""
+    statuses = [classify_unit(s)[0] for s in df["mcqs_json"]]
+    return df[["doctrine", "definition", "model", "story"]].assign(unit_status=statuses)
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _write_parquet(table, path):
+    tmp_path = path + ".tmp"
+    table.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def _source_signature(tsv_path):
+    st = os.stat(tsv_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def write_manifest(doctrines, tsv_path=TSV_PATH, manifest_path=MANIFEST_PATH):
+    """Danh sách doctrine (theo thứ tự xuất hiện) để app.py phục vụ / mà không cần pandas."""
+    manifest = {"source": _source_signature(tsv_path), "doctrines": list(doctrines)}
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def load_manifest(tsv_path=TSV_PATH, manifest_path=MANIFEST_PATH):
+    """Danh sách doctrine từ manifest, hoặc None nếu manifest thiếu / không khớp TSV hiện tại."""
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("source") != _source_signature(tsv_path):
+            return None
+        return manifest["doctrines"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_columnar(tsv_path=TSV_PATH, parquet_path=PARQUET_PATH, table_path=TABLE_PATH,
+                   manifest_path=MANIFEST_PATH):
+    """Ghi bản Parquet của dữ liệu story, bảng MCQ chuẩn hoá (cần pyarrow) và manifest doctrine."""
+    import pandas as pd
+    df = pd.read_csv(tsv_path, sep='\t')
+    write_manifest(df["doctrine"].dropna().astype(str).unique(), tsv_path, manifest_path)
+    if not _has_pyarrow():
+        print("[⚠️] pyarrow is not installed → skipping Parquet output")
+        return False
+    _write_parquet(build_columnar(df), parquet_path)
+    _write_parquet(build_mcq_table(df), table_path)
+    return True
+
+
+def is_fresh(path, tsv_path=TSV_PATH):
+    if not os.path.exists(path) or not _has_pyarrow():
+        return False
+    return not (os.path.exists(tsv_path) and os.path.getmtime(path) < os.path.getmtime(tsv_path))
+
+
+def load_mcq_dataset(columns=None, tsv_path=TSV_PATH, parquet_path=PARQUET_PATH):
+    """Dữ liệu story (doctrine, model, story, ...), ưu tiên Parquet và chỉ đọc các cột cần."""
+    import pandas as pd
+    if is_fresh(parquet_path, tsv_path):
+        return pd.read_parquet(parquet_path, columns=columns)
+    df = build_columnar(pd.read_csv(tsv_path, sep='\t'))
+    return df if columns is None else df[columns]
+
+
+def load_mcq_table(columns=None, tsv_path=TSV_PATH, table_path=TABLE_PATH):
+    """Bảng MCQ chuẩn hoá; nếu bản Parquet thiếu/cũ thì dựng lại từ TSV."""
+    import pandas as pd
+    if is_fresh(table_path, tsv_path):
+        return pd.read_parquet(table_path, columns=columns)
+    table = build_mcq_table(pd.read_csv(tsv_path, sep='\t'))
+    return table if columns is None else table[columns]
+
+
+if __name__ == "__main__":
+    # Stage "mcq-table" của pipeline: dựng Parquet + bảng MCQ + manifest từ merged_mcq.tsv
+    import pandas as pd
+    if write_columnar():
+        table = pd.read_parquet(TABLE_PATH, columns=["status"])
+        print(f"✅ Columnar copy saved to: {PARQUET_PATH}")
+        print(f"✅ MCQ table saved to: {TABLE_PATH}")
+        print(f"✅ Doctrine manifest saved to: {MANIFEST_PATH}")
+        print(table["status"].value_counts().to_string())
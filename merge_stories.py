@@ -1,27 +1,145 @@
-import pandas as pd
-
-# Đọc dữ liệu gốc
-df_origin = pd.read_csv("data/legal_doctrines_294.csv")
-
-# Đọc 3 kết quả
-df_mistral = pd.read_csv("outputs/294-doctrines-mistral/294_doctrine_stories.tsv", sep='\t')
-df_llama3 = pd.read_csv("outputs/294-doctrines-llama3/294_doctrine_stories.tsv", sep='\t')
-df_gpt35  = pd.read_csv("outputs/294-doctrines-gpt-3.5/294_doctrine_stories.tsv", sep='\t')
-
-# Đổi tên cột story
-df_mistral.rename(columns={"story": "mistral_story"}, inplace=True)
-df_llama3.rename(columns={"story": "llama3_story"}, inplace=True)
-df_gpt35.rename(columns={"story": "gpt35_story"}, inplace=True)
-
-# Merge lần lượt
-df_merged = df_origin.merge(
-    df_mistral[['doctrine', 'mistral_story']], on='doctrine'
-).merge(
-    df_llama3[['doctrine', 'llama3_story']], on='doctrine'
-).merge(
-    df_gpt35[['doctrine', 'gpt35_story']], on='doctrine'
-)
-
-# Xuất file
-df_merged.to_csv("outputs/merged_stories.tsv", sep='\t', index=False)
-print("✅ Đã xuất: outputs/merged_stories.tsv")
+import argparse
+import csv
+import itertools
+import sys
+
+from shards import discover_models, story_column, story_files
+
+csv.field_size_limit(sys.maxsize)
+
+ORIGIN_PATH = "data/legal_doctrines_294.csv"
+OUTPUT_PATH = "outputs/merged_stories.tsv"
+MISSING_PATH = "outputs/merged_stories_missing.tsv"
+
+
+# ==== Đọc CSV theo luồng, kèm vị trí byte của từng dòng ====
+def iter_records(f, delimiter):
+    """Duyệt các dòng CSV của file nhị phân f (từ vị trí hiện tại) → (row, offset bắt đầu dòng)."""
+    position = f.tell()
+
+    def lines():
+        nonlocal position
+        for line in iter(f.readline, b""):
+            position += len(line)
+            yield line.decode("utf-8")
+
+    reader = csv.reader(lines(), delimiter=delimiter)
+    start = position
+    # csv.reader chỉ lấy đúng số line của 1 bản ghi → position là đầu bản ghi kế tiếp
+    for row in reader:
+        yield row, start
+        start = position
+
+
+class StoryIndex:
+    """Hash index doctrine → vị trí các dòng story của 1 model (file đầy đủ + các shard).
+
+    Chỉ giữ offset trong bộ nhớ; nội dung story được đọc lại bằng seek khi ghi,
+    nên bộ nhớ tăng theo số doctrine chứ không theo độ dài story.
+    Doctrine đã có ở file trước thì bỏ qua ở file sau (như shards.read_stories).
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.files = [open(path, "rb") for path in story_files(model)]
+        self.offsets = {}
+        self.story_col = {}
+        for file_idx, f in enumerate(self.files):
+            records = iter_records(f, "\t")
+            header, _ = next(records, ([], 0))
+            self.story_col[file_idx] = header.index("story")
+            doctrine_col = header.index("doctrine")
+            seen_here = set()
+            for row, offset in records:
+                if not row:
+                    continue
+                doctrine = row[doctrine_col]
+                if doctrine in self.offsets and doctrine not in seen_here:
+                    continue
+                seen_here.add(doctrine)
+                self.offsets.setdefault(doctrine, []).append((file_idx, offset))
+
+    def stories(self, doctrine):
+        result = []
+        for file_idx, offset in self.offsets.get(doctrine, []):
+            f = self.files[file_idx]
+            f.seek(offset)
+            row, _ = next(iter_records(f, "\t"))
+            result.append(row[self.story_col[file_idx]] if len(row) > self.story_col[file_idx] else "")
+        return result
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+# ==== Join ====
+def merge_stories(models, origin_path=ORIGIN_PATH, output_path=OUTPUT_PATH, missing_path=MISSING_PATH,
+                  keep_missing=False):
+    """Join 1 lần theo doctrine giữa danh sách gốc và story của mọi model.
+
+    Đọc danh sách gốc theo luồng, ghi từng dòng ngay. Doctrine có nhiều story ở
+    1 model sinh ra mọi tổ hợp (như inner merge của pandas). Doctrine thiếu ở
+    model nào được ghi vào missing_path; keep_missing=True thì vẫn giữ dòng
+    với story rỗng thay vì bỏ.
+    """
+    indexes = [StoryIndex(m) for m in models]
+    missing = {m: [] for m in models}
+    written = 0
+    try:
+        with open(origin_path, newline="", encoding="utf-8") as infile, \
+             open(output_path, "w", newline="", encoding="utf-8") as outfile:
+            reader = csv.reader(infile)
+            header = next(reader)
+            doctrine_col = header.index("doctrine")
+            writer = csv.writer(outfile, delimiter="\t", lineterminator="\n")
+            writer.writerow(header + [story_column(m) for m in models])
+
+            for row in reader:
+                if not row:
+                    continue
+                doctrine = row[doctrine_col]
+                per_model = []
+                for model, index in zip(models, indexes):
+                    stories = index.stories(doctrine)
+                    if not stories:
+                        missing[model].append(doctrine)
+                        stories = [""] if keep_missing else []
+                    per_model.append(stories)
+                for combo in itertools.product(*per_model):
+                    writer.writerow(row + list(combo))
+                    written += 1
+    finally:
+        for index in indexes:
+            index.close()
+
+    with open(missing_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(["doctrine", "model"])
+        for model in models:
+            writer.writerows((doctrine, model) for doctrine in missing[model])
+    return written, missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gộp story của mọi model theo doctrine")
+    parser.add_argument("--models", nargs="*", default=None,
+                        help="Mặc định: các model trong model.py / outputs có file story")
+    parser.add_argument("--keep-missing", action="store_true",
+                        help="Giữ doctrine thiếu story ở 1 model (để trống) thay vì bỏ")
+    args = parser.parse_args()
+
+    models = args.models or discover_models()
+    if not models:
+        raise SystemExit("❌ No story files found under outputs/294-doctrines-*/")
+    written, missing = merge_stories(models, keep_missing=args.keep_missing)
+
+    print(f"📋 Models: {', '.join(models)}")
+    for model, doctrines in missing.items():
+        if doctrines:
+            preview = ", ".join(doctrines[:5]) + (" ..." if len(doctrines) > 5 else "")
+            print(f"[⚠️] {model}: missing {len(doctrines)} doctrine(s) → {preview}")
+    if any(missing.values()):
+        action = "kept with empty story" if args.keep_missing else "dropped"
+        print(f"    ({action}; full list in {MISSING_PATH})")
+    print(f"✅ Đã xuất: {OUTPUT_PATH} ({written} dòng)")
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram độ trễ theo route và theo từng bước bên trong request, xuất ở /metrics
+# theo định dạng text của Prometheus. Số liệu nằm trong bộ nhớ của từng process
+# (mỗi gunicorn worker có 1 bộ riêng, Prometheus tự cộng khi scrape từng worker).
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Histogram có nhãn, an toàn khi nhiều thread cùng observe()."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, dict(v, counts=list(v["counts"]))) for k, v in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {series['count']}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series['count']}")
+        return "\n".join(lines)
+
+
+REQUEST_SECONDS = Histogram("app_request_duration_seconds", "Thời gian xử lý request theo route",
+                            ["method", "route", "status"])
+PHASE_SECONDS = Histogram("app_phase_duration_seconds", "Thời gian từng bước bên trong request",
+                          ["route", "phase"])
+PLOT_REGEN_SECONDS = Histogram("app_plot_regen_duration_seconds", "Thời gian chạy analyze.py ở background",
+                               ["ok"])
+REGISTRY = [REQUEST_SECONDS, PHASE_SECONDS, PLOT_REGEN_SECONDS]
+
+
+def render_metrics():
+    return "\n".join(h.render() for h in REGISTRY) + "\n"
+
+
+# ==== Đo từng bước ====
+_local = threading.local()
+
+
+@contextmanager
+def phase(name):
+    """Đo 1 bước (đọc dữ liệu, render template, ...); ngoài request thì route = "-"."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        request_phases = getattr(_local, "phases", None)
+        if request_phases is not None:
+            request_phases.append((name, duration))
+        PHASE_SECONDS.observe(duration, route=getattr(_local, "route", "-"), phase=name)
+
+
+def observe_plot_regen(ok, duration):
+    PLOT_REGEN_SECONDS.observe(duration, ok=str(bool(ok)).lower())
+
+
+# ==== Gắn vào Flask app ====
+def init_app(app, slow_ms=None, slow_log_path=None):
+    """Đo mọi request và thêm route /metrics.
+
+    slow_ms (mặc định lấy từ SLOW_REQUEST_MS, bỏ trống = tắt): request chậm hơn
+    ngưỡng này được ghi 1 dòng JSON (kèm thời gian từng bước) vào slow_log_path.
+    """
+    from flask import Response, request
+
+    if slow_ms is None and os.getenv("SLOW_REQUEST_MS"):
+        slow_ms = float(os.getenv("SLOW_REQUEST_MS"))
+    slow_log_path = slow_log_path or os.getenv("SLOW_REQUEST_LOG", "logs/slow_requests.jsonl")
+    slow_log_lock = threading.Lock()
+
+    @app.before_request
+    def _start_timer():
+        _local.started = time.perf_counter()
+        _local.phases = []
+        # Dùng mẫu route (vd. /evaluate/<doctrine>) để số nhãn không tăng theo dữ liệu
+        _local.route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    @app.after_request
+    def _record(response):
+        started = getattr(_local, "started", None)
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        route, phases = _local.route, _local.phases
+        _local.started, _local.phases, _local.route = None, None, "-"
+        if route == "/metrics":
+            return response
+        REQUEST_SECONDS.observe(duration, method=request.method, route=route, status=response.status_code)
+        if slow_ms is not None and duration * 1000 >= slow_ms:
+            phases_ms = {}
+            for name, d in phases:
+                phases_ms[name] = round(phases_ms.get(name, 0.0) + d * 1000, 2)
+            record = {
+                "ts": time.time(), "method": request.method, "path": request.path, "route": route,
+                "status": response.status_code, "duration_ms": round(duration * 1000, 2),
+                "phases_ms": phases_ms,
+            }
+            os.makedirs(os.path.dirname(slow_log_path) or ".", exist_ok=True)
+            with slow_log_lock, open(slow_log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,293 @@
+import argparse
+import csv
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batching import ITEM_HEADER_RE
+
+# Server giả lập /chat/completions của OpenRouter (OpenAI-compatible) để đo
+# throughput, retry và giới hạn concurrency mà không tốn tiền / mạng.
+# Dùng: python mock_openrouter.py --port 8765 --latency lognormal:0.3,0.5 --rate-429 0.05
+#       OPENAI_BASE=http://127.0.0.1:8765/v1 python main.py --model mistral --no-cache
+
+CANNED_STORY = (
+    "Maria signed a contract to buy a small bakery from Tom. Before the sale closed, "
+    "Tom learned the oven was broken but said nothing. When Maria discovered the problem, "
+    "she asked a court to cancel the deal. The judge explained that the doctrine protects a "
+    "buyer who relied on a seller's silence about a defect the buyer could not have found."
+)
+CANNED_MCQS = [
+    {"type": "concept", "question": "Which legal concept does the story illustrate?",
+     "options": ["Duty to disclose", "Adverse possession", "Double jeopardy", "Eminent domain"],
+     "answer": "Duty to disclose"},
+    {"type": "ending", "question": "What is the most likely outcome for Maria?",
+     "options": ["The contract can be cancelled", "She must pay double", "Tom keeps the bakery and the money",
+                 "The case is dismissed for lack of standing"],
+     "answer": "The contract can be cancelled"},
+    {"type": "limitation", "question": "When would the doctrine NOT help Maria?",
+     "options": ["If the defect was obvious on inspection", "If Tom knew about the defect",
+                 "If Maria relied on Tom's silence", "If the oven was essential to the business"],
+     "answer": "If the defect was obvious on inspection"},
+]
+ERROR_5XX = (500, 502, 503, 504)
+
+
+# ==== Phân phối độ trễ ====
+def parse_latency(spec):
+    """'fixed:0.2' | 'uniform:0.1,0.5' | 'normal:mean,sd' | 'lognormal:median,sigma' | 'none' → hàm sinh giây."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    if kind == "none":
+        return lambda rng: 0.0
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"❌ Unknown latency '{spec}'. Use fixed/uniform/normal/lognormal/none")
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+# ==== Payload trả về ====
+class CannedPayloads:
+    """Story / MCQ trả về: mặc định là mẫu cố định, hoặc lấy ngẫu nhiên từ merged_mcq.tsv."""
+
+    def __init__(self, tsv_path=None):
+        self.stories = [CANNED_STORY]
+        self.mcqs = [json.dumps(CANNED_MCQS, ensure_ascii=False)]
+        if tsv_path:
+            csv.field_size_limit(sys.maxsize)
+            with open(tsv_path, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f, delimiter="\t"))
+            self.stories = [r["story"] for r in rows if (r.get("story") or "").strip()] or self.stories
+            self.mcqs = [r["mcqs_json"] for r in rows if (r.get("mcqs_json") or "").startswith("[")] or self.mcqs
+
+    def content_for(self, data, rng, drop_rate=0.0):
+        prompt = " ".join(str(m.get("content", "")) for m in data.get("messages", []))
+        ids = ITEM_HEADER_RE.findall(prompt)
+        if ids:
+            # Prompt batch (batching.py): trả {"items": [...]}, bỏ ngẫu nhiên 1 số item để thử fallback
+            if "multiple-choice" in prompt:
+                items = [{"id": i, "mcqs": json.loads(rng.choice(self.mcqs))} for i in ids]
+            else:
+                items = [{"id": i, "story": rng.choice(self.stories)} for i in ids]
+            return json.dumps({"items": [it for it in items if rng.random() >= drop_rate]}, ensure_ascii=False)
+        if "multiple-choice" in prompt:
+            return rng.choice(self.mcqs)
+        return rng.choice(self.stories)
+
+
+# ==== Thống kê phía server ====
+class ServerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.durations = []
+            self.statuses = {}
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self, status, duration):
+        with self._lock:
+            self.in_flight -= 1
+            self.durations.append(duration)
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            ordered = sorted(self.durations)
+            return {
+                "requests": len(ordered),
+                "statuses": dict(self.statuses),
+                "elapsed_seconds": elapsed,
+                "requests_per_second": len(ordered) / elapsed if elapsed > 0 else 0.0,
+                "latency_p50": percentile(ordered, 50),
+                "latency_p99": percentile(ordered, 99),
+                "max_in_flight": self.max_in_flight,
+            }
+
+
+def make_handler(config):
+    rng = random.Random(config["seed"])
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # giữ kết nối cho connection pool của httpx
+
+        def log_message(self, format, *args):
+            if config["verbose"]:
+                super().log_message(format, *args)
+
+        def _send_json(self, status, body, headers=None):
+            payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_stream(self, data, body, content):
+            """Trả SSE (chunked): mỗi từ 1 chunk, cách nhau --token-latency giây; client ngắt thì dừng."""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            response_id = f"mock-{int(time.time() * 1000)}"
+
+            def event(payload):
+                chunk = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+
+            tokens = re.findall(r"\s*\S+", content)
+            try:
+                for i, token in enumerate(tokens):
+                    if i and config["token_latency"]:
+                        time.sleep(config["token_latency"])
+                    event(json.dumps({"id": response_id, "model": data.get("model", "mock"), "choices": [
+                        {"index": 0, "delta": {"content": token}, "finish_reason": None}]}, ensure_ascii=False))
+                event(json.dumps({"id": response_id, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                                  "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(tokens),
+                                            "total_tokens": len(body) // 4 + len(tokens)}}))
+                event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # client cắt sớm (chạm ngưỡng từ/token)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, config["stats"].snapshot())
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length)
+            if self.path.rstrip("/").endswith("/stats/reset"):
+                config["stats"].reset()
+                self._send_json(200, {"ok": True})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            stats = config["stats"]
+            stats.begin()
+            started = time.perf_counter()
+            with rng_lock:
+                delay = config["latency"](rng)
+                roll = rng.random()
+                status = (429 if roll < config["rate_429"]
+                          else rng.choice(ERROR_5XX) if roll < config["rate_429"] + config["rate_5xx"]
+                          else 200)
+                try:
+                    data = json.loads(body or b"{}")
+                except ValueError:
+                    data, status = {}, 400
+                content = config["payloads"].content_for(data, rng, config["batch_drop"]) if status == 200 else None
+                if content is not None and rng.random() < config["runaway"]:
+                    content = " ".join([content] * 10)  # model "chạy quá đà"
+            time.sleep(delay)
+
+            if status == 200 and data.get("stream"):
+                self._send_stream(data, body, content)
+            elif status == 200:
+                # Không stream: client vẫn phải chờ model sinh hết mọi token
+                time.sleep(config["token_latency"] * max(0, len(content.split()) - 1))
+                self._send_json(200, {
+                    "id": f"mock-{int(time.time() * 1000)}",
+                    "object": "chat.completion",
+                    "model": data.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(content) // 4,
+                              "total_tokens": (len(body) + len(content)) // 4},
+                })
+            else:
+                headers = {"Retry-After": str(config["retry_after"])} if status == 429 and config["retry_after"] else None
+                self._send_json(status, {"error": {"code": status, "message": "injected error"}}, headers)
+            stats.end(status, time.perf_counter() - started)
+
+    return Handler
+
+
+def make_server(host="127.0.0.1", port=8765, latency="lognormal:0.3,0.5", rate_429=0.0, rate_5xx=0.0,
+                retry_after=None, canned=None, seed=0, verbose=False, batch_drop=0.0, token_latency=0.0,
+                runaway=0.0):
+    """Tạo server (chưa chạy); gọi serve_forever() hoặc chạy trong thread. Port 0 = chọn port trống."""
+    config = {
+        "latency": parse_latency(latency), "rate_429": rate_429, "rate_5xx": rate_5xx,
+        "retry_after": retry_after, "payloads": CannedPayloads(canned), "seed": seed,
+        "verbose": verbose, "stats": ServerStats(), "batch_drop": batch_drop,
+        "token_latency": token_latency, "runaway": runaway,
+    }
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.stats = config["stats"]
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server giả lập OpenRouter /chat/completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:0.3,0.5",
+                        help="fixed:S | uniform:A,B | normal:MEAN,SD | lognormal:MEDIAN,SIGMA | none")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Tỉ lệ request trả 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Tỉ lệ request trả 500/502/503/504")
+    parser.add_argument("--retry-after", type=float, default=None, help="Header Retry-After (giây) kèm 429")
+    parser.add_argument("--canned", default=None,
+                        help="Lấy story/MCQ ngẫu nhiên từ file TSV này (vd. outputs/merged_mcq.tsv)")
+    parser.add_argument("--batch-drop", type=float, default=0.0,
+                        help="Tỉ lệ item bị thiếu trong phản hồi của prompt batch (để thử fallback)")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="Chế độ stream: số giây giữa 2 chunk (độ trễ ở trên là time-to-first-token)")
+    parser.add_argument("--runaway", type=float, default=0.0,
+                        help="Tỉ lệ phản hồi dài gấp 10 lần (thử cắt sớm --max-words)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="In log từng request")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.rate_429, args.rate_5xx,
+                         args.retry_after, args.canned, args.seed, args.verbose, args.batch_drop,
+                         args.token_latency, args.runaway)
+    print(f"✅ Mock OpenRouter listening on {base_url(server)}  (set OPENAI_BASE to this)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats.snapshot(), indent=2))
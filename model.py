@@ -1,9 +1,12 @@
+# Model key (dùng cho --model, tên thư mục outputs) → tên model trên OpenRouter
+MODEL_NAMES = {
+    "mistral": "mistralai/mistral-7b-instruct:free",
+    "llama3": "meta-llama/llama-3-8b-instruct:free",
+    "gpt-3.5": "openai/gpt-3.5-turbo-0613"
+}
+
+
 def get_model_name(key: str) -> str:
-    mapping = {
-        "mistral": "mistralai/mistral-7b-instruct:free",
-        "llama3": "meta-llama/llama-3-8b-instruct:free",
-        "gpt-3.5": "openai/gpt-3.5-turbo-0613"
-    }
-    if key not in mapping:
-        raise ValueError(f"❌ Unknown model key '{key}'. Available keys: {list(mapping.keys())}")
-    return mapping[key]
+    if key not in MODEL_NAMES:
+        raise ValueError(f"❌ Unknown model key '{key}'. Available keys: {list(MODEL_NAMES.keys())}")
+    return MODEL_NAMES[key]
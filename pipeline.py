@@ -0,0 +1,223 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from shards import story_files
+
+# ==== Cấu hình pipeline ====
+MODELS = ["mistral", "llama3", "gpt-3.5"]
+STATE_PATH = ".cache/pipeline_state.json"
+
+
+def story_path(model):
+    return f"outputs/294-doctrines-{model}/294_doctrine_stories.tsv"
+
+
+def story_inputs(model):
+    """File story mà merge/metrics đọc: file đầy đủ + các shard (main.py --shard / --claim)."""
+    return [story_path(model)] + [p for p in story_files(model) if p != story_path(model)]
+
+
+class Stage:
+    """1 bước trong pipeline: lệnh chạy + file đầu vào/đầu ra + các bước phụ thuộc.
+
+    manual=True: chỉ chạy khi được chỉ định rõ (--only) hoặc --force; nếu
+    không, output có sẵn được coi như dữ liệu nguồn (vd. crawl Wikipedia).
+    """
+
+    def __init__(self, name, cmd, inputs, outputs, deps=(), cwd=None, manual=False):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = inputs
+        self.outputs = outputs
+        self.deps = list(deps)
+        self.cwd = cwd
+        self.manual = manual
+
+
+def build_stages(models=MODELS):
+    py = sys.executable
+    stages = [
+        Stage("crawl", [py, "wiki_crawler.py"],
+              inputs=["crawler/wiki_crawler.py", "crawler/complex-law-doctrine-list.csv"],
+              outputs=["data/legal_doctrines_294.csv"], cwd="crawler", manual=True),
+    ]
+    for model in models:
+        stages.append(Stage(
+            f"generate-{model}", [py, "main.py", "--model", model, "--resume"],
+            inputs=["main.py", "model.py", "data/legal_doctrines_294.csv"],
+            outputs=[story_path(model)], deps=["crawl"]))
+    generate = [f"generate-{m}" for m in models]
+    stages += [
+        Stage("merge", [py, "merge_stories.py", "--models"] + list(models),
+              inputs=["merge_stories.py", "shards.py", "data/legal_doctrines_294.csv"]
+                     + [p for m in models for p in story_inputs(m)],
+              outputs=["outputs/merged_stories.tsv", "outputs/merged_stories_missing.tsv"], deps=generate),
+        Stage("mcq", [py, "generate_mcq.py", "--resume"],
+              inputs=["generate_mcq.py", "outputs/merged_stories.tsv"],
+              outputs=["outputs/merged_mcq.tsv"], deps=["merge"]),
+        Stage("metrics", [py, "evaluate_stories.py"],
+              inputs=["evaluate_stories.py"] + [p for m in models for p in story_inputs(m)],
+              outputs=["outputs/story_evaluation.tsv"], deps=generate),
+        Stage("plots", [py, "visualize.py"],
+              inputs=["visualize.py", "outputs/story_evaluation.tsv"],
+              outputs=[f"outputs/{m}_comparison.png" for m in ("word_count", "flesch_score", "ttr")],
+              deps=["metrics"]),
+        Stage("mcq-table", [py, "mcq_dataset.py"],
+              inputs=["mcq_dataset.py", "outputs/merged_mcq.tsv"],
+              outputs=["outputs/merged_mcq.parquet", "outputs/mcq_table.parquet",
+                       "outputs/doctrine_manifest.json"], deps=["mcq"]),
+        Stage("mcq-report", [py, "analyze_mcq.py"],
+              inputs=["analyze_mcq.py", "outputs/mcq_table.parquet"],
+              outputs=["outputs/mcq_summary.csv", "outputs/mcq_valid_counts.png",
+                       "outputs/mcq_report.md", "outputs/mcq_report.html"],
+              deps=["mcq-table"]),
+    ]
+    return {s.name: s for s in stages}
+
+
+# ==== Fingerprint ====
+def file_digest(path):
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint(paths, extra=()):
+    """Hash nội dung các file (và tham số lệnh) để biết đầu vào/đầu ra có đổi không."""
+    h = hashlib.sha256()
+    for item in extra:
+        h.update(f"arg:{item}\n".encode("utf-8"))
+    for path in sorted(paths):
+        h.update(f"file:{path}:{file_digest(path)}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def is_up_to_date(stage, state):
+    record = state.get(stage.name)
+    if record is None:
+        return False
+    return (record.get("inputs") == fingerprint(stage.inputs, stage.cmd[1:])
+            and record.get("outputs") == fingerprint(stage.outputs))
+
+
+# ==== Chạy ====
+def select(stages, targets):
+    """Các stage cần xét: targets và toàn bộ phụ thuộc của chúng."""
+    selected = set()
+    todo = list(targets or stages)
+    while todo:
+        name = todo.pop()
+        if name not in stages:
+            raise ValueError(f"❌ Unknown stage '{name}'. Available: {list(stages)}")
+        if name not in selected:
+            selected.add(name)
+            todo.extend(stages[name].deps)
+    return [n for n in stages if n in selected]
+
+
+def run_stage(stage):
+    started = time.time()
+    proc = subprocess.run(stage.cmd, cwd=stage.cwd)
+    return proc.returncode, time.time() - started
+
+
+def run_pipeline(targets=None, models=MODELS, force=False, jobs=4, dry_run=False):
+    stages = build_stages(models)
+    names = select(stages, targets)
+    explicit = set(targets or [])
+    state = load_state()
+    status = {}
+
+    def decide(name):
+        stage = stages[name]
+        if any(status[d] == "failed" for d in stage.deps):
+            return "failed"
+        if stage.manual and name not in explicit and not force:
+            return "skipped" if all(os.path.exists(p) for p in stage.outputs) else "run"
+        # Phụ thuộc vừa chạy lại thì fingerprint đầu vào sẽ tự đổi
+        if not force and is_up_to_date(stage, state):
+            return "skipped"
+        return "run"
+
+    pending = {}
+    with ThreadPoolExecutor(jobs) as pool:
+        while len(status) < len(names):
+            ready = [n for n in names if n not in status and n not in pending
+                     and all(status.get(d) in ("skipped", "done", "failed")
+                             for d in stages[n].deps if d in names)]
+            for name in ready:
+                decision = decide(name)
+                if decision != "run":
+                    status[name] = decision
+                    print(f"[⏭️] {name}: {'up to date' if decision == 'skipped' else 'dependency failed'}")
+                elif dry_run:
+                    status[name] = "done"
+                    print(f"[🔎] {name}: would run → {' '.join(stages[name].cmd)}")
+                else:
+                    print(f"[🚀] {name}: {' '.join(stages[name].cmd)}")
+                    pending[pool.submit(run_stage, stages[name])] = name
+            if ready and not pending:
+                continue
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = pending.pop(future)
+                returncode, duration = future.result()
+                stage = stages[name]
+                if returncode == 0:
+                    status[name] = "done"
+                    state[name] = {
+                        "inputs": fingerprint(stage.inputs, stage.cmd[1:]),
+                        "outputs": fingerprint(stage.outputs),
+                        "finished_at": time.time(),
+                    }
+                    save_state(state)
+                    print(f"[✓] {name} ({duration:.1f}s)")
+                else:
+                    status[name] = "failed"
+                    # Bỏ bản ghi lần thành công trước: lần sau phải chạy lại dù đầu vào không đổi
+                    if state.pop(name, None) is not None:
+                        save_state(state)
+                    print(f"[✗] {name} failed with exit code {returncode}")
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy pipeline crawl → generate → merge → MCQ → metrics → plots")
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="Chỉ chạy các stage này (và phụ thuộc của chúng)")
+    parser.add_argument("--models", nargs="*", default=MODELS)
+    parser.add_argument("--force", action="store_true", help="Chạy lại kể cả khi đầu vào không đổi")
+    parser.add_argument("--jobs", type=int, default=4, help="Số stage chạy song song tối đa")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ in các stage sẽ chạy")
+    args = parser.parse_args()
+
+    status = run_pipeline(args.only, args.models, args.force, args.jobs, args.dry_run)
+    sys.exit(1 if "failed" in status.values() else 0)
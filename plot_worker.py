@@ -0,0 +1,144 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class PlotRegenerator:
+    """Chạy lại analyze.py ở background thread thay vì trong request.
+
+    Các lần submit chỉ gọi signal(); nhiều signal liên tiếp được gộp lại
+    (debounce) thành 1 lần chạy. Trạng thái lần chạy gần nhất được ghi ra
+    status_path để mọi worker đều hiển thị cùng 1 thông tin.
+    """
+
+    def __init__(self, script="analyze.py", plot_dir="static/plots",
+                 debounce=2.0, max_delay=30.0, before_run=None, after_run=None):
+        self.script = script
+        self.plot_dir = plot_dir
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.before_run = before_run
+        self.after_run = after_run  # after_run(ok, duration): vd. ghi metrics
+        self.status_path = os.path.join(plot_dir, "status.json")
+        self._lock_path = os.path.join(plot_dir, ".regen.lock")
+        self._cond = threading.Condition()
+        self._pending_since = None
+        self._last_signal = None
+        self._running = False
+        self._thread = None
+        self._status_cache = (None, {})
+
+    def signal(self):
+        """Báo có dữ liệu mới; trả về ngay."""
+        with self._cond:
+            now = time.time()
+            self._last_signal = now
+            if self._pending_since is None:
+                self._pending_since = now
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="plot-regen", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._pending_since is None:
+                    self._cond.wait()
+                # Đợi đến khi hết "burst" (hoặc quá max_delay) rồi mới chạy
+                while True:
+                    now = time.time()
+                    quiet_at = self._last_signal + self.debounce
+                    deadline = self._pending_since + self.max_delay
+                    if now >= quiet_at or now >= deadline:
+                        break
+                    self._cond.wait(min(quiet_at, deadline) - now)
+                requested_at = self._pending_since
+                self._pending_since = None
+                self._running = True
+            try:
+                self._run_once(requested_at)
+            finally:
+                with self._cond:
+                    self._running = False
+
+    def _run_once(self, requested_at):
+        os.makedirs(self.plot_dir, exist_ok=True)
+        started = time.time()
+        with open(self._lock_path, "a") as lock:
+            # Chỉ 1 worker chạy analyze.py tại 1 thời điểm
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                if self.before_run is not None:
+                    self.before_run()
+                proc = subprocess.run(
+                    [sys.executable, self.script],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+                )
+                ok, error = proc.returncode == 0, proc.stderr[-2000:]
+            except Exception as e:
+                ok, error = False, str(e)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+        duration = time.time() - started
+        if self.after_run is not None:
+            self.after_run(ok, duration)
+        status = self.read_status()
+        status.update({
+            "last_run_at": time.time(),
+            "last_run_ok": ok,
+            "last_duration": round(duration, 3),
+            "last_error": None if ok else error,
+        })
+        if ok:
+            status["data_as_of"] = requested_at
+        tmp_path = f"{self.status_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp_path, self.status_path)
+        if not ok:
+            print(f"[⚠️] {self.script} failed → {error}", file=sys.stderr)
+
+    def read_status(self):
+        # Chỉ đọc lại file khi nó đổi (mỗi request /result đều gọi)
+        try:
+            st = os.stat(self.status_path)
+            signature = (st.st_mtime_ns, st.st_size)
+            if signature == self._status_cache[0]:
+                return dict(self._status_cache[1])
+            with open(self.status_path) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        self._status_cache = (signature, status)
+        return dict(status)
+
+    def status(self):
+        """Trạng thái cho /result: ảnh cũ bao lâu, có đang chờ/đang chạy không."""
+        status = self.read_status()
+        now = time.time()
+        with self._cond:
+            pending_since = self._pending_since
+            running = self._running
+        data_as_of = status.get("data_as_of")
+        return {
+            "running": running,
+            "pending": pending_since is not None,
+            "last_run_ok": status.get("last_run_ok"),
+            "age_seconds": round(now - data_as_of, 1) if data_as_of else None,
+            "stale_seconds": round(now - pending_since, 1) if pending_since else 0.0,
+            # Mốc thời gian tuyệt đối: trang /result tự tính "bao lâu" ở trình duyệt
+            "data_as_of": data_as_of,
+            "pending_since": pending_since,
+        }
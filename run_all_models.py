@@ -1,8 +1,7 @@
-import subprocess
-
-models = ["mistral", "llama3", "gpt-3.5"]
-
-for model in models:
-    print(f"🚀 Generating stories with model: {model}")
-    subprocess.run(["python", "main.py", "--model", model])
+import sys
+from pipeline import MODELS, run_pipeline
 
+# Sinh story cho tất cả model (song song, bỏ qua model có đầu vào không đổi).
+# Toàn bộ pipeline: python pipeline.py
+status = run_pipeline(targets=[f"generate-{model}" for model in MODELS])
+sys.exit(1 if "failed" in status.values() else 0)
@@ -0,0 +1,171 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+import uuid
+
+
+def order_key(models):
+    """Thứ tự model hiển thị ↔ chuỗi lưu ở cột model_order, vd. 'gpt35,mistral,llama3'."""
+    return ",".join(models)
+
+
+class CoverageScheduler:
+    """Giao doctrine có ít đánh giá nhất (kèm thứ tự story ít dùng nhất của doctrine đó).
+
+    - next(): doctrine có tổng số đánh giá (+ lượt đang giao chưa nộp) nhỏ nhất,
+      rồi trong doctrine đó chọn thứ tự story có ít đánh giá nhất; mở 1 lease
+    - peek(): như next() nhưng không mở lease (cho dashboard / API chỉ đọc)
+    - refresh(): đọc đánh giá mới qua store.read_since (kể cả của worker khác),
+      mỗi đánh giá tốn O(log n)
+    Heap theo doctrine, xoá lười: mỗi lần đổi số đếm đẩy 1 entry mới, entry cũ
+    bị bỏ khi lên đỉnh. Lease có id và hạn riêng, chỉ nằm trong bộ nhớ của
+    từng worker; số đánh giá thì lấy từ store nên các worker thống nhất với nhau.
+    """
+
+    def __init__(self, store, models_by_doctrine, randomize=False, lease_seconds=0, seed=None):
+        self.store = store
+        self.randomize = randomize
+        self.lease_seconds = lease_seconds
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cursor = 0
+        # Đánh giá cũ không có model_order → thứ tự mặc định (như trong index)
+        self._default_order = {d: tuple(models) for d, models in models_by_doctrine.items()}
+        self._orders = {d: list(itertools.permutations(models)) for d, models in models_by_doctrine.items()}
+        self._rank = {d: i for i, d in enumerate(self._orders)}
+        self.counts = {(d, order): 0 for d, orders in self._orders.items() for order in orders}
+        self.doctrine_counts = dict.fromkeys(self._orders, 0)
+        self.ignored = 0  # đánh giá cho doctrine / thứ tự không còn trong index
+        self._leases = {}  # lease id → slot
+        self._slot_leases = {}
+        self._doctrine_leases = {}
+        self._expiry = []  # heap (thời điểm hết hạn, lease id)
+        self._version = dict.fromkeys(self._orders, 0)
+        self._heap = []
+        for doctrine in self._orders:
+            self._push(doctrine)
+        self.refresh()
+
+    def _priority(self, doctrine):
+        return self.doctrine_counts[doctrine] + self._doctrine_leases.get(doctrine, 0)
+
+    def _push(self, doctrine):
+        self._version[doctrine] += 1
+        tie = self._rng.random() if self.randomize else self._rank[doctrine]
+        heapq.heappush(self._heap, (self._priority(doctrine), tie, self._version[doctrine], doctrine))
+        if len(self._heap) > 4 * len(self._version) + 64:
+            self._compact()
+
+    def _compact(self):
+        self._heap = [e for e in self._heap if e[2] == self._version[e[3]]]
+        heapq.heapify(self._heap)
+
+    def _top(self):
+        while self._heap and self._heap[0][2] != self._version[self._heap[0][3]]:
+            heapq.heappop(self._heap)
+        return self._heap[0][3] if self._heap else None
+
+    def _best_order(self, doctrine):
+        """Thứ tự story ít đánh giá nhất của doctrine (tối đa 3! = 6 thứ tự nên quét thẳng)."""
+        def key(order):
+            slot = (doctrine, order)
+            used = self.counts[slot] + self._slot_leases.get(slot, 0)
+            return used, self._rng.random() if self.randomize else 0
+        return min(self._orders[doctrine], key=key)
+
+    def _slot_of(self, row):
+        doctrine = row.get("doctrine")
+        order = row.get("model_order")
+        if order:
+            return doctrine, tuple(str(order).split(","))
+        return doctrine, self._default_order.get(doctrine)
+
+    def add(self, row):
+        slot = self._slot_of(row)
+        if slot not in self.counts:
+            self.ignored += 1
+            return
+        self.counts[slot] += 1
+        self.doctrine_counts[slot[0]] += 1
+        self._push(slot[0])
+
+    def refresh(self):
+        with self._lock:
+            if self.store.generation() == self._cursor:
+                return self  # không có đánh giá mới
+            rows, self._cursor = self.store.read_since(self._cursor)
+            for row in rows:
+                self.add(row)
+        return self
+
+    # ==== Lease: slot vừa giao được tính thêm 1 cho tới khi nộp hoặc hết hạn ====
+    def _lease(self, slot):
+        lease_id = uuid.uuid4().hex[:16]
+        self._leases[lease_id] = slot
+        self._slot_leases[slot] = self._slot_leases.get(slot, 0) + 1
+        self._doctrine_leases[slot[0]] = self._doctrine_leases.get(slot[0], 0) + 1
+        heapq.heappush(self._expiry, (time.time() + self.lease_seconds, lease_id))
+        self._push(slot[0])
+        return lease_id
+
+    def _release(self, lease_id):
+        slot = self._leases.pop(lease_id, None)
+        if slot is None:
+            return False  # đã nộp / đã hết hạn / lease của worker khác
+        self._slot_leases[slot] -= 1
+        self._doctrine_leases[slot[0]] -= 1
+        self._push(slot[0])
+        return True
+
+    def release(self, lease_id):
+        """Nhả lease khi đánh giá được nộp (lease do worker khác mở thì tự hết hạn ở đó)."""
+        with self._lock:
+            return self._release(lease_id)
+
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            self._release(heapq.heappop(self._expiry)[1])
+
+    def next(self, lease=True):
+        """Slot cần đánh giá tiếp theo → {"doctrine", "order", "count", "order_count", "lease"}.
+
+        count là tổng số đánh giá của doctrine; None nếu không có slot nào.
+        """
+        self.refresh()
+        with self._lock:
+            self._expire(time.time())
+            doctrine = self._top()
+            if doctrine is None:
+                return None
+            order = self._best_order(doctrine)
+            assignment = {"doctrine": doctrine, "order": list(order),
+                          "count": self.doctrine_counts[doctrine], "order_count": self.counts[(doctrine, order)],
+                          "lease": None}
+            if lease and self.lease_seconds:
+                assignment["lease"] = self._lease((doctrine, order))
+        return assignment
+
+    def peek(self):
+        """Như next() nhưng không mở lease."""
+        return self.next(lease=False)
+
+    def coverage(self):
+        """Độ phủ hiện tại theo doctrine và theo (doctrine, thứ tự story)."""
+        with self._lock:
+            self._expire(time.time())
+            doctrine_counts = list(self.doctrine_counts.values())
+            slot_counts = list(self.counts.values())
+            leased = len(self._leases)
+        return {
+            "doctrines": len(doctrine_counts),
+            "evaluations": sum(doctrine_counts),
+            "ignored": self.ignored,
+            "min": min(doctrine_counts, default=0),
+            "max": max(doctrine_counts, default=0),
+            "unevaluated": sum(1 for c in doctrine_counts if c == 0),
+            "slots": len(slot_counts),
+            "unevaluated_slots": sum(1 for c in slot_counts if c == 0),
+            "leased": leased,
+        }
@@ -0,0 +1,73 @@
+import argparse
+import glob
+import hashlib
+import os
+
+# Chia danh sách doctrine thành N shard theo hash (ổn định giữa các máy / lần chạy)
+# để nhiều process cùng sinh story cho 1 model; merge_stories.py gộp lại.
+
+STORY_FILE = "294_doctrine_stories.tsv"
+
+
+def parse_shard(spec):
+    """'i/N' → (i, N), 0 <= i < N."""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"❌ Invalid shard '{spec}'. Use i/N, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"❌ Invalid shard '{spec}': need 0 <= i < N")
+    return index, count
+
+
+def shard_of(doctrine, count):
+    return int(hashlib.sha1(doctrine.encode("utf-8")).hexdigest(), 16) % count
+
+
+def story_dir(model):
+    return f"outputs/294-doctrines-{model}"
+
+
+def shard_path(model, index, count):
+    return os.path.join(story_dir(model), f"294_doctrine_stories.shard-{index:03d}-of-{count:03d}.tsv")
+
+
+def story_files(model):
+    """File story của 1 model: file đầy đủ (nếu có) rồi tới các shard theo thứ tự."""
+    full = os.path.join(story_dir(model), STORY_FILE)
+    shards = sorted(glob.glob(os.path.join(story_dir(model), "294_doctrine_stories.shard-*-of-*.tsv")))
+    return ([full] if os.path.exists(full) else []) + shards
+
+
+def read_stories(model):
+    """Gộp file đầy đủ và mọi shard của 1 model thành 1 DataFrame.
+
+    Doctrine đã có ở file trước thì bỏ ở file sau; trong cùng 1 file giữ nguyên như cũ.
+    """
+    import pandas as pd
+    files = story_files(model)
+    if not files:
+        raise FileNotFoundError(f"❌ No story files for model '{model}' in {story_dir(model)}")
+    frames, seen = [], set()
+    for path in files:
+        df = pd.read_csv(path, sep='\t')
+        frames.append(df[~df["doctrine"].isin(seen)])
+        seen.update(df["doctrine"])
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def story_column(model):
+    """Tên cột trong merged_stories.tsv: gpt-3.5 → gpt35_story (generate_mcq đọc theo tên này)."""
+    return model.replace("-", "").replace(".", "") + "_story"
+
+
+def discover_models():
+    """Các model có file story: theo thứ tự trong model.py, rồi các thư mục outputs khác."""
+    from model import MODEL_NAMES
+    known = [m for m in MODEL_NAMES if story_files(m)]
+    prefix = "outputs/294-doctrines-"
+    others = sorted(
+        path[len(prefix):] for path in glob.glob(prefix + "*")
+        if os.path.isdir(path) and path[len(prefix):] not in MODEL_NAMES and story_files(path[len(prefix):])
+    )
+    return known + others